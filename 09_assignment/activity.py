@@ -17,6 +17,8 @@ import sys
 
 # initial values
 bufferSize = 100
+# rate of the resampled accelerometer data (Hz)
+SAMPLE_RATE = 100.0
 
 
 ###############################################################################
@@ -25,13 +27,19 @@ class WiimoteNode(Node):
     Outputs sensor data from a Wiimote.
 
     Supported sensors: accelerometer (3 axes)
-    Text input box allows for setting a Bluetooth MAC address.
+    Text input box allows for setting a Bluetooth MAC address; if it is
+    left empty, the first registered Wiimote that answers is used.
     Pressing the "connect" button tries connecting to the Wiimote.
     Update rate can be changed via a spinbox widget. Setting it to "0"
     activates callbacks everytime a new sensor value arrives (which is
     quite often -> performance hit)
+    Independent of the update rate, the outputs carry all samples since the
+    last update, resampled to SAMPLE_RATE.
     """
     nodeName = "Wiimote"
+    # callbacks run on the Wiimote's dispatcher thread; the flowchart and
+    # its plots must be updated on the GUI thread (queued connection)
+    sigSamplesArrived = QtCore.Signal()
 
     def __init__(self, name):
         terminals = {
@@ -40,7 +48,8 @@ class WiimoteNode(Node):
             'accelZ': dict(io='out'),
         }
         self.wiimote = None
-        self._acc_vals = []
+        self.resampler = None
+        self._acc_vals = np.zeros((0, 3))
         self.ui = QtGui.QWidget()
         self.layout = QtGui.QGridLayout()
 
@@ -64,23 +73,25 @@ class WiimoteNode(Node):
         if len(sys.argv) == 2:
             self.btaddr = sys.argv[1]
         else:
-            self.btaddr = "B8:AE:6E:1B:A3:9B"
+            self.btaddr = ""
         self.text.setText(self.btaddr)
+        self.text.setPlaceholderText("any registered Wiimote")
         self.update_timer = QtCore.QTimer()
         self.update_timer.timeout.connect(self.update_all_sensors)
 
         Node.__init__(self, name, terminals=terminals)
+        self.sigSamplesArrived.connect(self.update_all_sensors)
 
     def update_all_sensors(self):
-        if self.wiimote is None:
+        if self.resampler is None:
             return
-        self._acc_vals = self.wiimote.accelerometer
+        self._acc_vals = self.resampler.update()[0]
         # todo: other sensors...
-        self.update()
+        if len(self._acc_vals):
+            self.update()
 
     def update_accel(self, acc_vals):
-        self._acc_vals = acc_vals
-        self.update()
+        self.sigSamplesArrived.emit()
 
     def ctrlWidget(self):
         return self.ui
@@ -90,31 +101,37 @@ class WiimoteNode(Node):
         if self.wiimote is not None:
             self.wiimote.disconnect()
             self.wiimote = None
+            self.resampler = None
             self.connect_button.setText("connect")
             return
-        if len(self.btaddr) == 17:
-            self.connect_button.setText("connecting...")
-            self.wiimote = wiimote.connect(self.btaddr)
-            print "wiimote connected"
-            if self.wiimote is None:
-                self.connect_button.setText("try again")
-            else:
-                self.connect_button.setText("disconnect")
-                self.set_update_rate(self.update_rate_input.value())
+        self.connect_button.setText("connecting...")
+        try:
+            # without an address, the registry picks the controller
+            self.wiimote = wiimote.connect(self.btaddr or None)
+        except IOError as e:
+            print "connecting failed: %s" % e
+            self.connect_button.setText("try again")
+            return
+        print "wiimote connected"
+        self.connect_button.setText("disconnect")
+        # raw values, like the training data
+        self.resampler = self.wiimote.accelerometer.resampler(
+            SAMPLE_RATE, raw=True)
+        self.set_update_rate(self.update_rate_input.value())
 
     def set_update_rate(self, rate):
         if rate == 0:  # use callbacks for max. update rate
-            self.wiimote.accelerometer.register_callback(self.update_accel)
+            self.wiimote.accelerometer.register_callback(
+                self.update_accel, policy=wiimote.LATEST)
             self.update_timer.stop()
         else:
             self.wiimote.accelerometer.unregister_callback(self.update_accel)
             self.update_timer.start(1000.0/rate)
 
     def process(self, **kwdargs):
-        x, y, z = self._acc_vals
-        return {'accelX': np.array([x]),
-                'accelY': np.array([y]),
-                'accelZ': np.array([z])}
+        return {'accelX': self._acc_vals[:, 0],
+                'accelY': self._acc_vals[:, 1],
+                'accelZ': self._acc_vals[:, 2]}
 
 fclib.registerNodeType(WiimoteNode, [('Sensor',)])
 
@@ -213,12 +230,7 @@ class SvmClassifierNode (Node):
     def process(self, **kwds):
         self.bufferSize = len(kwds['dataIn'])
         data = kwds['dataIn']
-        Fs = int(self.bufferSize)
         n = len(data)
-        k = np.arange(n)
-        T = n/Fs
-        frq = k/T
-        frq = frq[range(n/2)]
         Y = np.fft.fft(data)/n
         Y = Y[range(n/2)]
         return {'dataOut': abs(Y)}
@@ -6,34 +6,45 @@ import time
 import sys
 import csv
 
+# training data is recorded at a fixed rate, see classify.py
+SAMPLE_RATE = 100.0
+
 wm = wiimote.connect(sys.argv[1])
+# raw values; the Wiimote reports continuously while it is resampled, so
+# resting periods are recorded, too
+resampler = wm.accelerometer.resampler(SAMPLE_RATE, raw=True)
+
+
+def show_values(state):
+    # the driver only calls this when the values have changed
+    if wm.buttons["A"]:
+        print("%d,%d,%d" % tuple(state))
+
+wm.accelerometer.register_callback(show_values, deadband=0)
 
-xp = yp = zp = 0
 iteration = 0
 logInit = 1 # set to '0' to write column headers        
 onceA = 0
 
 
 while True:
+    # samples since the last pass; dropped unless A is held
+    samples = resampler.update()[0].round().astype(int)
     if wm.buttons["A"]:
         onceA = 0
-        x,y,z = wm.accelerometer
-        if (x != xp) or (y != yp) or (z != zp):
-            print("%d,%d,%d") % (x,y,z)
-        xp,yp,zp = x,y,z
-        
         logfile = open("trainingdata/"+str(iteration)+"data.csv", "a")
         out = csv.DictWriter(logfile, ["X", "Y", "Z"])
         if logInit == 0:
             out.writeheader()
             logInit = 1
 
-        #d = {"Iteration": iteration, "X": xp, "Y": yp, "Z": zp} #uncomment to add iteration as first column
-        d = {"X": xp, "Y": yp, "Z": zp}
-        out.writerow(d)
+        for x,y,z in samples:
+            #d = {"Iteration": iteration, "X": x, "Y": y, "Z": z} #uncomment to add iteration as first column
+            d = {"X": x, "Y": y, "Z": z}
+            out.writerow(d)
         logfile.close()
-        
-        time.sleep(0.01)
+
+    time.sleep(0.01)
 
     if wm.buttons["B"]:
         if(onceA == 0):
@@ -32,39 +32,192 @@
 
 # based on the awesome documentation at http://wiibrew.org/wiki/Wiimote
 
-import bluetooth
+import collections
+import csv
+import importlib
+import json
+import numpy as np
+import os
+import select
+import socket
 import threading
 import time
+import traceback
 
 VERSION = (0,2)
 DEBUG = False
+STATS = False # collect WiiMote.stats() from the start, see enable_stats()
 KNOWN_DEVICES = ['Nintendo RVL-CNT-01', 'Nintendo RVL-CNT-01-TR']
+# connect() hands addresses starting with one of these prefixes to the
+# connect() function of the module, which is imported when first used.
+# Plain Bluetooth addresses are connected via PyBluez.
+TRANSPORTS = {'replay:': 'wiimote_replay',       # recorded reports
+              'emulator:': 'wiimote_emulator',   # emulated Wiimotes
+              'hidraw:': 'wiimote_hidraw'}       # Linux hidraw device nodes
+
+bluetooth = None # PyBluez, imported by _bluetooth() when first needed
+
+def _bluetooth():
+    global bluetooth
+    if bluetooth is None:
+        import bluetooth as pybluez
+        bluetooth = pybluez
+    return bluetooth
+
+def _is_timeout(error):
+    # PyBluez reports timeouts as BluetoothError("timed out")
+    return isinstance(error, socket.timeout) or 'timed out' in str(error)
+# accelerometer calibration of every Wiimote connected so far, by btaddr
+CALIBRATION_CACHE = os.path.join(os.path.expanduser('~'), '.wiimote',
+                                 'calibration.json')
+# model and last-seen time of every Wiimote found or connected so far
+DEVICE_REGISTRY = os.path.join(os.path.expanduser('~'), '.wiimote',
+                               'devices.json')
+_registry_lock = threading.Lock()
 
 def find():
     """
     Uses Bluetooth SDP to find available Wiimotes. 
     Returns a list of (bt_addr, device_name) tuples.
-    Only supported Wiimote devices are returned.
+    Only supported Wiimote devices are returned. They are added to the
+    device registry, so connecting to them needs no name lookup.
     """
-    devices = bluetooth.find_service()
+    devices = _bluetooth().find_service()
     wiimotes = []
     for device in devices:
         if device["name"] in KNOWN_DEVICES:
             wiimotes.append((device["host"], device["name"]))
+            _remember_device(device["host"], device["name"])
     return wiimotes
 
-def connect(btaddr, model=None):
+def known_devices():
+    """
+    Returns (bt_addr, device_name, last_seen) tuples of all Wiimotes in the
+    device registry, most recently seen first. *last_seen* is a time.time()
+    value.
+    """
+    registry = _load_json(DEVICE_REGISTRY)
+    devices = [(btaddr, entry['model'], entry['last_seen'])
+               for btaddr, entry in registry.items()]
+    return sorted(devices, key=lambda device: device[2], reverse=True)
+
+def connect(btaddr=None, model=None, **options):
     """
     Establishes a connection to the Wiimote at *btaddr* and returns a Wiimote
-    object. If no *model* is specified, the model is determined automatically.
+    object. If no *model* is specified, it is taken from the device registry
+    or, for a Wiimote that has not been seen before, determined by a name
+    lookup. Without *btaddr*, all registered Wiimotes are tried, see
+    connect_any() for the *options*.
+    Addresses starting with a prefix of TRANSPORTS are passed on to the
+    connect() function of that backend, e.g. "replay:<file>" replays a
+    recording (see wiimote_replay.connect() for the *options*),
+    "emulator:" connects to an emulated Wiimote and "hidraw:/dev/hidraw3"
+    to a Wiimote paired by the Linux kernel.
+    """
+    if btaddr is None:
+        return connect_any(**options)
+    for prefix, module_name in TRANSPORTS.items():
+        if btaddr.startswith(prefix):
+            transport = importlib.import_module(module_name)
+            return transport.connect(btaddr[len(prefix):], model, **options)
+    model = _check_model(btaddr, model)
+    wm = WiiMote(btaddr, model)
+    if wm._persistent:
+        _remember_device(btaddr, model)
+    return wm
+
+def connect_any(addresses=None, timeout=10.0):
+    """
+    Connects to all *addresses* (default: every registered Wiimote) in
+    parallel and returns the WiiMote of the first one that answers. Later
+    connections are closed again. Raises an IOError if none has answered
+    within *timeout* seconds.
     """
+    if addresses is None:
+        addresses = [device[0] for device in known_devices()]
+    if not addresses:
+        raise IOError("No Wiimote registered yet, use find() first.")
+    lock = threading.Lock()
+    answered = threading.Event()
+    winner = []
+
+    def attempt(btaddr):
+        try:
+            wm = connect(btaddr)
+        except Exception as e:
+            _debug("connecting to %s failed: %s" % (btaddr, e))
+            return
+        with lock:
+            if winner: # too late
+                wm.disconnect()
+                return
+            winner.append(wm)
+        answered.set()
+
+    threads = [threading.Thread(target=attempt, args=(btaddr,))
+               for btaddr in addresses]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    deadline = _monotonic() + timeout
+    while not answered.is_set() and any(t.is_alive() for t in threads):
+        remaining = deadline - _monotonic()
+        if remaining <= 0:
+            break
+        answered.wait(min(remaining, 0.05))
+    with lock:
+        if winner:
+            return winner[0]
+        winner.append(None) # closes connections made from now on
+    raise IOError("No Wiimote answered (%d tried, timeout %.1f s)." %
+                  (len(addresses), timeout))
+
+def _check_model(btaddr, model):
+    if model == None:
+        model = _registered_model(btaddr)
     if model == None:
-        model = bluetooth.lookup_name(btaddr)
+        model = _bluetooth().lookup_name(btaddr)
     if model in KNOWN_DEVICES:
-        return WiiMote(btaddr, model)
+        return model
     else:
         raise Exception("Wiimote model '%s' unknown!" % (model))
 
+def _registered_model(btaddr):
+    entry = _load_json(DEVICE_REGISTRY).get(btaddr)
+    return entry['model'] if entry else None
+
+def _remember_device(btaddr, model):
+    with _registry_lock:
+        registry = _load_json(DEVICE_REGISTRY)
+        registry[btaddr] = {'model': model, 'last_seen': time.time()}
+        _store_json(DEVICE_REGISTRY, registry)
+
+def _load_json(path):
+    # contents of a cache file, empty if it is missing or broken
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+def _store_json(path, data):
+    try:
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            json.dump(data, f, sort_keys=True)
+    except (IOError, OSError) as e:
+        _debug("could not write %s: %s" % (path, e))
+
+def connect_async(btaddr, model=None):
+    """
+    Coroutine version of connect() for asyncio (Python 3.6+ only):
+    wm = await wiimote.connect_async(btaddr)
+    See wiimote_async for details.
+    """
+    import wiimote_async
+    return wiimote_async.connect(btaddr, model)
+
 def _val_to_byte_list(number, num_bytes, big_endian=True):
     if number > (2**(8*num_bytes))-1:
         raise ValueError("Unsigned integer %d does not fit into %d bytes!" % (number, num_bytes))
@@ -77,15 +230,18 @@ def _val_to_byte_list(number, num_bytes, big_endian=True):
             byte_list.append(val)
     return byte_list
 
-def _flatten(list_of_lists):
+def _to_byte_list(data):
+    # a single byte or a - possibly nested - sequence of bytes
+    if isinstance(data, int):
+        return [data]
+    if isinstance(data, (bytearray, bytes)) and not str is bytes:
+        return list(data)
     out = []
-    if type(list_of_lists) is int:
-        return [list_of_lists]
-    for item in list_of_lists:
-        if type(item) is int:
+    for item in data:
+        if isinstance(item, (list, tuple)):
+            out += _to_byte_list(item)
+        else:
             out.append(item)
-        elif type(item) is list:
-            out += _flatten(item)
     return out
 
 def _add_padding(byte_list, intended_length, padding_byte=0x00):
@@ -98,15 +254,845 @@ def _debug(msg):
     if DEBUG:
         print("DEBUG: " + str(msg))
 
-class Accelerometer(object):
-   
-    SUPPORTED_REPORTS = [0x31, 0x33]
+# time.monotonic() is not available on Python 2
+_monotonic = getattr(time, 'monotonic', time.time)
+_perf_counter = getattr(time, 'perf_counter', time.time)
+
+
+class SensorHistory(object):
+    """
+    Ring buffer holding the last *size* samples of a sensor as records of a
+    structured numpy array (*dtype*). It is written by the receive thread
+    and never reallocated.
+
+    Readers keep a cursor (the number of samples they have seen) and call
+    since(cursor) to get all newer samples as one read-only view into the
+    buffer, without copying. The view stays valid until *size* more samples
+    have arrived, so copy it if you need to keep it longer.
+    """
+
+    def __init__(self, dtype, size=4096):
+        self.dtype = np.dtype(dtype)
+        self.size = size
+        self.count = 0
+        self.gaps = [] # see mark_gap()
+        # each sample is stored twice (at i and i + size), so every window of
+        # up to *size* samples is a contiguous slice
+        self._data = np.zeros(2 * size, dtype=self.dtype)
+
+    def __len__(self):
+        return min(self.count, self.size)
+
+    def __repr__(self):
+        return "<SensorHistory %d/%d samples>" % (len(self), self.size)
+
+    def append(self, record):
+        slot = self.count % self.size
+        self._data[slot] = record
+        self._data[slot + self.size] = record
+        # only now the record becomes visible to readers
+        self.count += 1
+
+    def since(self, cursor):
+        """
+        Returns (samples, cursor) with all samples received after *cursor*
+        and the cursor to pass next time. If more than *size* samples have
+        arrived since then, only the latest *size* are returned.
+        """
+        end = self.count
+        start = max(cursor, end - self.size, 0)
+        offset = start % self.size
+        samples = self._data[offset:offset + end - start]
+        samples.flags.writeable = False
+        return samples, end
+
+    def latest(self, num_samples):
+        """ Returns a read-only view of the last *num_samples* samples. """
+        return self.since(self.count - num_samples)[0]
+
+    def mark_gap(self, start, end):
+        """
+        Records that no samples could arrive between the monotonic times
+        *start* and *end*, e.g. while the connection was lost. *gaps* holds
+        (count, start, end) tuples; the gap lies before sample number
+        *count*.
+        """
+        self.gaps.append((self.count, start, end))
+
+    def wait_for(self, count, timeout):
+        """
+        Waits up to *timeout* seconds for the sample after *count* to arrive.
+        Returns True if it did.
+        """
+        deadline = _monotonic() + timeout
+        while self.count <= count:
+            if _monotonic() >= deadline:
+                return False
+            time.sleep(0.005)
+        return True
+
+
+# Callback policies, see CallbackDispatcher
+DIRECT = 'direct'             # call on the receive thread (default)
+EVERY_SAMPLE = 'every_sample' # call on the dispatcher thread for every value
+LATEST = 'latest'             # only for the most recent value, skip the others
+BATCH = 'batch'               # with a list of *batch_size* values
+
+
+class _FuncWrapper(object):
+    """
+    Base of the objects that wrap a callback function *func*. They compare
+    equal to it, so unregister_callback(func) finds them.
+    """
+
+    def __init__(self, func):
+        self.func = func
+
+    def __eq__(self, other):
+        return other is self or other == self.func
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.func)
+
+
+class Subscription(_FuncWrapper):
+    """
+    A callback registered with a policy other than DIRECT. Calling it
+    hands the value over to the dispatcher thread.
+    """
+
+    def __init__(self, dispatcher, func, policy, batch_size, max_queue, copy):
+        _FuncWrapper.__init__(self, func)
+        self.policy = policy
+        self.copy = copy
+        self.batch_size = batch_size
+        self.max_queue = max_queue
+        self.dropped = 0
+        self.delivered = 0
+        self._dispatcher = dispatcher
+        self._pending = collections.deque()
+        self._batch = []
+        self._batch_started = None # receive time of the batch's first value
+        self._queued = False
+
+    def __call__(self, value):
+        if self.copy:
+            value = value.copy()
+        self._dispatcher._post(self, value)
+
+    @property
+    def depth(self):
+        return len(self._pending)
+
+    def _offer(self, value):
+        # called with the dispatcher's lock held
+        if self.policy == LATEST:
+            if self._pending:
+                self._pending.clear()
+                self.dropped += 1
+        elif self.policy == BATCH:
+            if not self._batch:
+                self._batch_started = _monotonic()
+            self._batch.append(value)
+            if len(self._batch) < self.batch_size:
+                return
+            value, self._batch = self._batch, []
+        self._push(value)
+
+    def _flush_batch(self):
+        # queues a partial batch, see CallbackDispatcher.max_batch_latency
+        value, self._batch = self._batch, []
+        self._push(value)
+
+    def _push(self, value):
+        if len(self._pending) >= self.max_queue:
+            dropped = self._pending.popleft()
+            self.dropped += len(dropped) if self.policy == BATCH else 1
+        self._pending.append(value)
+
+
+class CallbackDispatcher(threading.Thread):
+    """
+    Runs callbacks outside of the receive thread, so that slow callbacks
+    (GUI updates, ...) never delay the reception of reports.
+
+    Each subscription has its own queue of at most *max_queue* entries. If
+    it is full, the oldest entry is dropped and counted in its *dropped*
+    attribute; receiving never blocks. The thread is started with the
+    first subscription.
+
+    A BATCH subscription gets a partial batch once its first value is
+    *max_batch_latency* seconds old, so that the last values are not held
+    back while the Wiimote has nothing new to report.
+    """
+
+    def __init__(self, max_queue=256, max_batch_latency=0.1):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.max_queue = max_queue
+        self.max_batch_latency = max_batch_latency
+        self.running = True
+        self._thread_started = False
+        self._subscriptions = []
+        self._ready = collections.deque()
+        self._lock = threading.Condition()
+
+    def wrap(self, func, policy=DIRECT, batch_size=None, max_queue=None,
+             copy=False):
+        """
+        Returns the callable to register with a sensor for calling *func*
+        with the given *policy*. With *copy*, values are copied before they
+        are queued, for sensors that update their state in place.
+        """
+        if policy == DIRECT:
+            return func
+        if policy not in [EVERY_SAMPLE, LATEST, BATCH]:
+            raise TypeError("unknown callback policy '%s'" % policy)
+        if policy == BATCH:
+            if not batch_size or batch_size < 1:
+                raise TypeError("batch_size needed for policy BATCH")
+        else:
+            batch_size = 1
+        subscription = Subscription(self, func, policy, batch_size,
+                                    max_queue or self.max_queue, copy)
+        with self._lock:
+            self._subscriptions.append(subscription)
+            if not self._thread_started:
+                self._thread_started = True
+                self.start()
+        return subscription
+
+    def unwrap(self, callback):
+        """ Forgets about a callable returned by wrap(). """
+        with self._lock:
+            if callback in self._subscriptions:
+                self._subscriptions.remove(callback)
+
+    @property
+    def queue_depth(self):
+        """ Number of values waiting to be delivered, in all queues. """
+        return sum(s.depth for s in self._subscriptions)
+
+    @property
+    def dropped(self):
+        """ Number of values that were never delivered, in total. """
+        return sum(s.dropped for s in self._subscriptions)
+
+    def stats(self):
+        """
+        Returns a list of dicts with 'callback', 'policy', 'depth',
+        'dropped' and 'delivered' for each subscription.
+        """
+        with self._lock:
+            return [{'callback': s.func, 'policy': s.policy, 'depth': s.depth,
+                     'dropped': s.dropped, 'delivered': s.delivered}
+                    for s in self._subscriptions]
+
+    def stop(self):
+        """ Ends the thread once the queued values are delivered. """
+        with self._lock:
+            self.running = False
+            self._lock.notify()
+
+    def _post(self, subscription, value):
+        with self._lock:
+            started = bool(subscription._batch)
+            subscription._offer(value)
+            if not started and subscription._batch:
+                self._lock.notify() # recompute the wait in run()
+            self._mark_ready(subscription)
+
+    def _mark_ready(self, subscription):
+        # called with the lock held
+        if subscription._pending and not subscription._queued:
+            subscription._queued = True
+            self._ready.append(subscription)
+            self._lock.notify()
+
+    def _flush_batches(self):
+        # called with the lock held; queues the partial batches that are due
+        # and returns the seconds until the next one is, or None
+        now = _monotonic()
+        timeout = None
+        for subscription in self._subscriptions:
+            if not subscription._batch:
+                continue
+            due = subscription._batch_started + self.max_batch_latency - now
+            if due <= 0 or not self.running:
+                subscription._flush_batch()
+                self._mark_ready(subscription)
+            elif timeout is None or due < timeout:
+                timeout = due
+        return timeout
+
+    def run(self):
+        while True:
+            with self._lock:
+                while True:
+                    timeout = self._flush_batches()
+                    if self._ready or not self.running:
+                        break
+                    self._lock.wait(timeout)
+                if not self._ready:
+                    return
+                subscription = self._ready.popleft()
+                value = subscription._pending.popleft()
+                if subscription._pending: # others go first
+                    self._ready.append(subscription)
+                else:
+                    subscription._queued = False
+            try:
+                subscription.func(value)
+            except Exception:
+                traceback.print_exc()
+            subscription.delivered += 1
+
+
+class BatchCallback(_FuncWrapper):
+    """
+    Calls func(samples, times) with all samples that arrived in a
+    SensorHistory since the last call, once there are *max_samples* of them
+    or the oldest one is *max_latency_ms* older than the newest. *samples*
+    is a numpy array made by *to_array* from the history records, *times*
+    holds their receive times.
+    """
+
+    def __init__(self, func, history, to_array, max_samples, max_latency_ms,
+                 callback):
+        _FuncWrapper.__init__(self, func)
+        self.max_samples = min(max_samples, history.size)
+        self.max_latency = None if max_latency_ms is None else max_latency_ms / 1000.0
+        self._history = history
+        self._times = history._data['time']
+        self._to_array = to_array
+        self._callback = callback # func itself or a dispatcher Subscription
+        self._cursor = history.count
+
+    def update(self):
+        """ Called by the sensor after each new sample. """
+        count = self._history.count
+        pending = count - self._cursor
+        if pending < self.max_samples:
+            if self.max_latency is None or pending <= 0:
+                return
+            size = self._history.size
+            oldest = self._times[self._cursor % size]
+            if self._times[(count - 1) % size] - oldest < self.max_latency:
+                return
+        samples, self._cursor = self._history.since(self._cursor)
+        self._callback((self._to_array(samples), samples['time'].copy()))
+
+
+def _call_with_batch(func):
+    return lambda batch: func(*batch)
+
+
+class _ChangeFilter(_FuncWrapper):
+    """
+    Passes a state on to *callback* only if an element has changed by more
+    than *deadband* since the last state passed on, or if that was received
+    *heartbeat* seconds ago or earlier. Runs on the receive thread, before
+    a dispatcher queue.
+    """
+
+    def __init__(self, callback, deadband, heartbeat, com):
+        _FuncWrapper.__init__(self, callback)
+        self.deadband = deadband
+        self.heartbeat = heartbeat
+        self.suppressed = 0
+        self._com = com
+        self._last = None
+        self._last_time = None
+
+    def __call__(self, state):
+        now = self._com.report_time
+        if self._last is not None and \
+           (self.heartbeat is None or now - self._last_time < self.heartbeat) and \
+           not self._changed(state):
+            self.suppressed += 1
+            return
+        self._last = np.array(state) # the IR state changes in place
+        self._last_time = now
+        self.func(state)
+
+    def _changed(self, state):
+        return np.abs(np.subtract(state, self._last)).max() > self.deadband
+
+
+class _IRChangeFilter(_ChangeFilter):
+    """ Also passes on states in which objects appeared or disappeared. """
+
+    def _changed(self, state):
+        return ((state[:, 0] < 0) != (self._last[:, 0] < 0)).any() or \
+            _ChangeFilter._changed(self, state)
+
+
+def _filter_changes(callback, deadband, heartbeat_ms, com,
+                    filter_class=_ChangeFilter):
+    # only wraps callbacks that asked for it
+    if deadband is None and heartbeat_ms is None:
+        return callback
+    heartbeat = None if heartbeat_ms is None else heartbeat_ms / 1000.0
+    return filter_class(callback, deadband or 0, heartbeat, com)
+
+
+def _needs_heartbeat(callbacks):
+    return any(isinstance(callback, _ChangeFilter) and
+               callback.heartbeat is not None for callback in callbacks)
+
+
+# Interpolation methods, see Resampler
+LINEAR = 'linear'
+SINC = 'sinc'
+
+
+class Resampler(object):
+    """
+    Turns the irregularly timed samples of a SensorHistory into a stream at
+    a fixed *rate* (Hz). update() returns the output samples that can be
+    computed from the samples received so far. *to_array* makes an (N, k)
+    array from history records, e.g. Accelerometer.to_g; by default all
+    fields but the time are used.
+
+    With LINEAR, output samples are interpolated between their two
+    neighbours. SINC uses a Lanczos (windowed sinc) kernel of *lobes* lobes
+    with its cutoff at half the lower of the input and output rates, which
+    also avoids aliasing when downsampling. Its output lags *lobes* input
+    intervals behind, as it needs samples on both sides. The kernel assumes
+    roughly even input intervals; with a lot of jitter in the receive times,
+    LINEAR is more accurate.
+
+    All output times lie on one grid with steps of 1/*rate* s. Where no
+    sample arrived for more than *max_gap* seconds, e.g. while the
+    connection was lost, the grid is skipped instead of interpolated.
+    """
+
+    def __init__(self, history, rate, method=LINEAR, to_array=None, lobes=3,
+                 max_gap=0.25):
+        if method not in (LINEAR, SINC):
+            raise TypeError("unknown interpolation method '%s'" % method)
+        self.rate = float(rate)
+        self.method = method
+        self.lobes = lobes
+        self.max_gap = max_gap
+        self._history = history
+        self._to_array = to_array or self._fields_array
+        self._cursor = history.count
+        self._sensor = None # see close()
+        # received samples that later output samples still depend on
+        self._times = np.zeros(0)
+        self._values = None
+        self._origin = None # time of grid point 0
+        self._next = 0 # grid point of the next output sample
+
+    @staticmethod
+    def _fields_array(samples):
+        return np.column_stack([samples[name] for name in samples.dtype.names
+                                if name != 'time'])
+
+    def update(self):
+        """
+        Returns (samples, times) with the new output samples as an (N, k)
+        float array and their times as an (N,) array.
+        """
+        samples, self._cursor = self._history.since(self._cursor)
+        if len(samples):
+            values = np.asarray(self._to_array(samples), np.float64)
+            if self._values is None:
+                self._values = values[:0]
+                self._origin = samples['time'][0]
+            self._times = np.concatenate((self._times, samples['time']))
+            self._values = np.concatenate((self._values, values))
+        if self._values is None:
+            return np.zeros((0, 0)), np.zeros(0)
+        out = [(self._values[:0], self._times[:0])]
+        while True:
+            gaps = np.nonzero(np.diff(self._times) > self.max_gap)[0]
+            if not len(gaps):
+                break
+            # everything before the gap can be computed now
+            end = gaps[0] + 1
+            out.append(self._interpolate(self._times[:end], self._values[:end],
+                                         self._times[end - 1]))
+            self._times = self._times[end:]
+            self._values = self._values[end:]
+            self._next = max(self._next, int(np.ceil(
+                (self._times[0] - self._origin) * self.rate)))
+        limit = self._times[-1]
+        if self.method == SINC:
+            limit -= self.lobes * self._kernel_width(self._times)
+        out.append(self._interpolate(self._times, self._values, limit))
+        self._discard()
+        return (np.concatenate([values for values, times in out]),
+                np.concatenate([times for values, times in out]))
+
+    def _grid(self, start, limit):
+        first = max(self._next, int(np.ceil((start - self._origin) * self.rate)))
+        last = int(np.floor((limit - self._origin) * self.rate))
+        self._next = max(self._next, last + 1)
+        return self._origin + np.arange(first, last + 1) / self.rate
+
+    def _kernel_width(self, times):
+        # one lobe per input interval, or per output interval when
+        # downsampling, so that the kernel doubles as anti-aliasing filter
+        interval = np.median(np.diff(times)) if len(times) > 1 else 0.0
+        return max(interval, 1.0 / self.rate)
+
+    def _interpolate(self, times, values, limit):
+        grid = self._grid(times[0], limit)
+        if not len(grid):
+            return values[:0], grid
+        linear = np.column_stack([np.interp(grid, times, column)
+                                  for column in values.T])
+        if self.method == LINEAR:
+            return linear, grid
+        x = (grid[:, np.newaxis] - times) / self._kernel_width(times)
+        weights = np.sinc(x) * np.sinc(x / self.lobes)
+        weights[np.abs(x) >= self.lobes] = 0.0
+        if len(times) > 2:
+            # each sample stands for the time up to half way to its neighbours
+            weights *= np.gradient(times)
+        sums = weights.sum(axis=1)
+        # no sample within reach of the kernel: fall back to linear
+        covered = np.abs(sums) > 1e-6
+        linear[covered] = weights[covered].dot(values) / sums[covered, np.newaxis]
+        return linear, grid
+
+    def _discard(self):
+        next_time = self._origin + self._next / self.rate
+        if self.method == LINEAR:
+            keep = max(np.searchsorted(self._times, next_time, 'right') - 1, 0)
+        else:
+            keep = np.searchsorted(self._times, next_time - self.lobes *
+                                   self._kernel_width(self._times))
+        self._times = self._times[keep:]
+        self._values = self._values[keep:]
+
+    def close(self):
+        """
+        Releases the sensor this Resampler was made by, see
+        Accelerometer.resampler(). Received samples can still be updated.
+        """
+        if self._sensor is not None:
+            self._sensor._remove_resampler(self)
+            self._sensor = None
+
+
+class _Timer(object):
+    """ Calls *func* and keeps track of the time spent in it. """
+
+    def __init__(self, func):
+        self.func = func
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def __call__(self, *args):
+        start = _perf_counter()
+        result = self.func(*args)
+        elapsed = _perf_counter() - start
+        self.calls += 1
+        self.total += elapsed
+        if elapsed > self.max:
+            self.max = elapsed
+        return result
+
+    def stats(self):
+        return {'calls': self.calls, 'total_ms': self.total * 1000.0,
+                'mean_us': self.total * 1e6 / self.calls if self.calls else 0.0,
+                'max_us': self.max * 1e6}
+
+
+class Telemetry(object):
+    """
+    Counters and timings collected by a CommunicationHandler while
+    telemetry is enabled, see WiiMote.stats(). Inter-arrival times are
+    kept for the last WINDOW reports of each type.
+    """
+
+    WINDOW = 1024
+
+    def __init__(self):
+        self.started = _monotonic()
+        self.timeouts = 0
+        self.reconnects = 0
+        self.retries = 0 # of IR camera initialization steps
+        self.unexpected = 0 # reports that no sensor wanted in this mode
+        self.counts = {}
+        self.durations = {} # of single operations, e.g. IR initialization
+        self.timers = {}
+        self._last = {}
+        self._intervals = {}
+
+    def report_received(self, rpt_id, timestamp):
+        last = self._last.get(rpt_id)
+        if last is None:
+            self.counts[rpt_id] = 1
+            self._intervals[rpt_id] = np.zeros(self.WINDOW)
+        else:
+            count = self.counts[rpt_id]
+            self._intervals[rpt_id][(count - 1) % self.WINDOW] = timestamp - last
+            self.counts[rpt_id] = count + 1
+        self._last[rpt_id] = timestamp
+
+    def timer(self, name, func):
+        """ Returns a _Timer for *func*, which keeps the totals of *name*. """
+        timer = _Timer(func)
+        previous = self.timers.get(name)
+        if previous is not None: # the same function, wrapped again
+            timer.calls, timer.total, timer.max = \
+                previous.calls, previous.total, previous.max
+        self.timers[name] = timer
+        return timer
+
+    def stats(self):
+        reports = {}
+        for rpt_id, count in list(self.counts.items()):
+            entry = {'count': count}
+            intervals = self._intervals[rpt_id][:min(count - 1, self.WINDOW)]
+            if len(intervals) and intervals.sum() > 0:
+                median = np.median(intervals)
+                p50, p90, p99 = np.percentile(intervals, [50, 90, 99]) * 1000.0
+                jitter = np.percentile(np.abs(intervals - median),
+                                       [50, 90, 99]) * 1000.0
+                entry['rate'] = len(intervals) / intervals.sum()
+                entry['interval_ms'] = {'p50': p50, 'p90': p90, 'p99': p99,
+                                        'max': intervals.max() * 1000.0}
+                entry['jitter_ms'] = {'p50': jitter[0], 'p90': jitter[1],
+                                      'p99': jitter[2]}
+            reports['0x%02x' % rpt_id] = entry
+        return {'uptime': _monotonic() - self.started,
+                'reports': reports,
+                'unexpected': self.unexpected,
+                'timeouts': self.timeouts,
+                'reconnects': self.reconnects,
+                'retries': self.retries,
+                'durations': dict(self.durations),
+                'timers': dict((name, timer.stats())
+                               for name, timer in list(self.timers.items()))}
+
+
+def _flatten_stats(stats, prefix=''):
+    # {'a': {'b': 1}} -> [('a.b', 1)]
+    rows = []
+    for key in sorted(stats):
+        value = stats[key]
+        if isinstance(value, dict):
+            rows.extend(_flatten_stats(value, prefix + key + '.'))
+        else:
+            rows.append((prefix + key, value))
+    return rows
+
+
+class StatsLogger(threading.Thread):
+    """
+    Appends the stats of a WiiMote to a CSV file every *interval* seconds,
+    one (time, metric, value) row per value. See WiiMote.log_stats().
+    """
+
+    def __init__(self, wiimote, path, interval=10.0):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.wiimote = wiimote
+        self.path = path
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            self.write()
+
+    def write(self):
+        stats = self.wiimote.stats()
+        if stats is None:
+            return
+        now = time.time()
+        write_header = not os.path.exists(self.path)
+        with open(self.path, 'a') as f:
+            writer = csv.writer(f)
+            if write_header:
+                writer.writerow(['time', 'metric', 'value'])
+            for metric, value in _flatten_stats(stats):
+                writer.writerow(['%.3f' % now, metric, value])
+
+    def stop(self):
+        self._stopped.set()
+
+
+class _Sensor(object):
+    """
+    Base of the sensors with a stream of states: callbacks, batch callbacks
+    and polling. A sensor's data is requested from the Wiimote while it has
+    callbacks, was enabled or its state was read.
+    """
+
+    HISTORY_DTYPE = []
+    # sensors that update their state in place copy it for the dispatcher
+    _copy_state = False
+    _change_filter = _ChangeFilter
 
     def __init__(self, wiimote):
-        self._state = [0.0, 0.0, 0.0]
         self._wiimote = wiimote
         self._com = wiimote._com
         self._callbacks = []
+        self._batch_callbacks = []
+        self._resamplers = []
+        self.history = SensorHistory(self.HISTORY_DTYPE)
+        self._enabled = False
+        self._polled = False
+
+    @property
+    def active(self):
+        """ Whether any subscriber needs data of this sensor. """
+        return bool(self._callbacks or self._batch_callbacks or
+                    self._resamplers or self._enabled or self._polled)
+
+    def _needs_continuous(self):
+        # subscribers that need reports while the data does not change
+        return (bool(self._resamplers) or _needs_heartbeat(self._callbacks) or
+                any(batch.max_latency is not None
+                    for batch in self._batch_callbacks))
+
+    def _add_resampler(self, resampler):
+        resampler._sensor = self
+        self._resamplers.append(resampler)
+        self._wiimote._update_report_mode()
+        return resampler
+
+    def _remove_resampler(self, resampler):
+        if resampler in self._resamplers:
+            self._resamplers.remove(resampler)
+            self._wiimote._update_report_mode()
+
+    def enable(self):
+        """
+        Keeps data coming without a callback, e.g. for reading the history.
+        Reading the state enables the sensor, too.
+        """
+        self._enabled = True
+        return self._wiimote._update_report_mode()
+
+    def disable(self):
+        """ Stops data that is only needed for polling the state. """
+        self._enabled = self._polled = False
+        self._wiimote._update_report_mode()
+
+    def _poll(self):
+        # the first read of the state switches the sensor on
+        if self._polled:
+            return
+        was_active = self.active
+        self._polled = True
+        if not was_active:
+            self._wiimote._update_report_mode()
+            if self._data_expected() and not self._com.on_receive_thread():
+                self.history.wait_for(self.history.count, 0.2)
+
+    def _data_expected(self):
+        # whether data arrives once the sensor is switched on
+        return True
+
+    def register_callback(self, func, policy=DIRECT, batch_size=None):
+        """
+        Calls func(state) for every new state, see CallbackDispatcher for the
+        *policy* options.
+        """
+        return self._add_callback(func, policy, batch_size)
+
+    def _add_callback(self, func, policy, batch_size, deadband=None,
+                      heartbeat_ms=None):
+        self._callbacks.append(_filter_changes(
+            self._wiimote.dispatcher.wrap(func, policy, batch_size,
+                                          copy=self._copy_state),
+            deadband, heartbeat_ms, self._com, self._change_filter))
+        return self._wiimote._update_report_mode()
+
+    def unregister_callback(self, func):
+        if func in self._callbacks:
+            self._callbacks.remove(func)
+            self._wiimote.dispatcher.unwrap(func)
+            self._wiimote._update_report_mode()
+
+    def register_batch_callback(self, func, max_samples=32, max_latency_ms=None,
+                                policy=DIRECT):
+        """
+        Calls func(samples, times) with blocks of up to *max_samples* samples
+        and an (N,) array of their receive times. A block is delivered early
+        once its first sample is *max_latency_ms* older than its last one;
+        while such a callback is registered, the Wiimote reports continuously
+        so that samples keep arriving at rest. *policy* is one of the
+        register_callback() policies. See the sensor's class for the shape
+        of *samples*.
+        """
+        callback = self._wiimote.dispatcher.wrap(_call_with_batch(func), policy)
+        self._batch_callbacks.append(BatchCallback(
+            func, self.history, self._batch_array, max_samples, max_latency_ms,
+            callback))
+        return self._wiimote._update_report_mode()
+
+    def unregister_batch_callback(self, func):
+        for batch_callback in self._batch_callbacks[:]:
+            if batch_callback == func:
+                self._batch_callbacks.remove(batch_callback)
+                self._wiimote.dispatcher.unwrap(batch_callback._callback)
+        self._wiimote._update_report_mode()
+
+    def _notify_callbacks(self, state):
+        for callback in self._callbacks:
+            callback(state)
+        for batch_callback in self._batch_callbacks:
+            batch_callback.update()
+
+
+class _Calibrated(object):
+    # conversion of raw accelerometer values (x, y, z) to g
+
+    def _set_calibration(self, zero, one_g):
+        self.calibration = (list(zero), list(one_g))
+        self._zero = np.array(zero, np.float32)
+        self._scale = np.float32(1.0) / (np.array(one_g, np.float32) - self._zero)
+
+    @staticmethod
+    def _batch_array(samples):
+        return np.column_stack((samples['x'], samples['y'], samples['z']))
+
+    def to_g(self, raw):
+        """
+        Converts raw values to float32 values in units of g, using the
+        calibration. *raw* is an array-like of shape (..., 3) or a block of
+        history records, e.g. from history.since().
+        """
+        raw = np.asarray(raw)
+        if raw.dtype.names is not None:
+            raw = self._batch_array(raw)
+        return (raw.astype(np.float32) - self._zero) * self._scale
+
+
+class Accelerometer(_Sensor, _Calibrated):
+    """
+    The Wiimote's accelerometer. The state is a list of raw [x, y, z]
+    values, see to_g() and g for values in units of g. Batch callbacks get
+    (N, 3) blocks of raw x, y, z values.
+    """
+
+    SUPPORTED_REPORTS = [0x31, 0x33, 0x35, 0x37, 0x3e, 0x3f]
+
+    HISTORY_DTYPE = [('time', 'f8'), ('x', 'i2'), ('y', 'i2'), ('z', 'i2')]
+
+    # two copies of zero point and 1 g values, 10 bytes each incl. checksum
+    CALIBRATION_ADDRESS = 0x16
+    CALIBRATION_SIZE = 20
+    # used if the EEPROM can not be read (raw values for 0 g and 1 g)
+    DEFAULT_CALIBRATION = ([512, 512, 512], [616, 616, 616])
+
+    def __init__(self, wiimote):
+        _Sensor.__init__(self, wiimote)
+        self._state = [0.0, 0.0, 0.0]
+        self._interleaved = None # (x, z high nibble) from report 0x3e
+        self._set_calibration(*self.DEFAULT_CALIBRATION)
 
     def __len__(self):
         return len(self._state)
@@ -115,31 +1101,123 @@ class Accelerometer(object):
         return repr(self._state)
 
     def __getitem__(self, axis):
+        self._poll()
         if 0 <= axis <= 2:
             return self._state[axis]
         else:
             raise IndexError("list index %d out of range" % (axis))
-    
-    def register_callback(self, func):
-        self._callbacks.append(func)
 
-    def unregister_callback(self, func):
-        if func in self._callbacks:
-            self._callbacks.remove(func)
+    def register_callback(self, func, policy=DIRECT, batch_size=None,
+                          deadband=None, heartbeat_ms=None):
+        """
+        Calls func(state) for every new state, see CallbackDispatcher for the
+        *policy* options. With *deadband* (in raw units), func is only
+        called once an axis has moved by more than *deadband* since its last
+        call; 0 calls it on every change. *heartbeat_ms* calls it at least
+        that often anyway, which keeps the Wiimote reporting continuously.
+        """
+        return self._add_callback(func, policy, batch_size, deadband,
+                                  heartbeat_ms)
+
+    def resampler(self, rate=100.0, method=LINEAR, raw=False, **options):
+        """
+        Returns a Resampler that turns the received values into a stream of
+        values in units of g (raw values with *raw*) at a fixed *rate* (Hz).
+        Until it is closed, the sensor stays on and the Wiimote reports
+        continuously, so that a resting Wiimote is sampled as well instead
+        of leaving gaps.
+        """
+        return self._add_resampler(Resampler(
+            self.history, rate, method, None if raw else self.to_g, **options))
+
+    @property
+    def g(self):
+        """ The current state in units of g. """
+        self._poll()
+        return self.to_g(self._state)
+
+    def load_calibration(self):
+        """
+        Sets the calibration from the cache or, for a Wiimote that has not
+        been connected before, from its EEPROM. Called at connect time.
+        """
+        if self._load_cached_calibration():
+            return
+        try:
+            data = self._wiimote.memory.read(self.CALIBRATION_ADDRESS,
+                                             self.CALIBRATION_SIZE, eeprom=True)
+        except RuntimeError as e:
+            _debug("reading calibration failed: %s" % e)
+            return
+        self.set_calibration_data(data)
+
+    def set_calibration_data(self, data):
+        """
+        Sets the calibration from the EEPROM bytes at CALIBRATION_ADDRESS
+        and caches it. Keeps the previous one if no copy has a valid checksum.
+        """
+        for copy in [data[0:10], data[10:20]]:
+            calibration = self._parse_calibration(copy)
+            if calibration is not None:
+                self._set_calibration(*calibration)
+                self._store_cached_calibration(calibration)
+                return True
+        return False
+
+    @staticmethod
+    def _parse_calibration(data):
+        if len(data) < 10 or (sum(data[:9]) + 0x55) & 0xff != data[9]:
+            return None
+        # MSBs in bytes 0-2 (zero point) and 4-6 (1 g), LSBs in 3 and 7
+        zero = [(data[i] << 2) | ((data[3] >> (4 - 2 * i)) & 0x03) for i in range(3)]
+        one_g = [(data[4 + i] << 2) | ((data[7] >> (4 - 2 * i)) & 0x03) for i in range(3)]
+        if zero == one_g:
+            return None
+        return zero, one_g
+
+    def _load_cached_calibration(self):
+        if not self._wiimote._persistent:
+            return False
+        cache = _load_json(CALIBRATION_CACHE)
+        if self._wiimote.btaddr not in cache:
+            return False
+        self._set_calibration(*cache[self._wiimote.btaddr])
+        return True
+
+    def _store_cached_calibration(self, calibration):
+        if not self._wiimote._persistent:
+            return
+        cache = _load_json(CALIBRATION_CACHE)
+        cache[self._wiimote.btaddr] = calibration
+        _store_json(CALIBRATION_CACHE, cache)
 
-    def _notify_callbacks(self):
-        for callback in self._callbacks:
-            callback(self._state)
-    
     def handle_report(self, report):
         if report[0] in [0x3e, 0x3f]: # interleaved modes
-            raise NotImplementedError("Data reporting mode 0x3e/0x3f not supported")
-        x_msb, y_msb, z_msb = report[3:6]
+            self._handle_interleaved(report)
+            return
+        x_msb, y_msb, z_msb = report[3], report[4], report[5]
         x = (x_msb << 2) + ((report[1] & 0b01100000) >> 5)
         y = (y_msb << 2) + ((report[2] & 0b00100000) >> 4)
         z = (z_msb << 2) + ((report[2] & 0b01000000) >> 5)
+        self._update(x, y, z)
+
+    def _handle_interleaved(self, report):
+        # 0x3e holds x, 0x3f holds y; z is spread over the button bytes of
+        # both reports. Values have 8 bit precision only and are scaled to
+        # the 10 bit range of the other modes.
+        if report[0] == 0x3e:
+            z_high = ((report[1] & 0b01100000) >> 1) | ((report[2] & 0b01100000) << 1)
+            self._interleaved = (report[3], z_high)
+        elif self._interleaved is not None:
+            x, z_high = self._interleaved
+            self._interleaved = None
+            z = z_high | ((report[1] & 0b01100000) >> 5) | ((report[2] & 0b01100000) >> 3)
+            self._update(x << 2, report[3] << 2, z << 2)
+
+    def _update(self, x, y, z):
         self._state = [x, y, z]
-        self._notify_callbacks()
+        self.history.append((self._com.report_time, x, y, z))
+        self._notify_callbacks(self._state)
                     
     
 
@@ -158,13 +1236,25 @@ class Buttons(object):
                'Up': 0x0800,
     }
 
+    # (mask, name) pairs in bit order, used to decode changed bits only
+    MASK_TABLE = sorted((mask, btn) for btn, mask in BUTTONS.items())
+    # the remaining bits of the button word hold accelerometer LSBs
+    BUTTON_MASK = sum(BUTTONS.values())
+
+    # every input report except the extension-only 0x3d carries button data
+    SUPPORTED_REPORTS = [0x20, 0x21, 0x22, 0x30, 0x31, 0x32, 0x33, 0x34, 0x35,
+                         0x36, 0x37, 0x3e, 0x3f]
+
     def __init__(self, wiimote):
         self._wiimote = wiimote
         self._com = wiimote._com
         self._state = {}
         for button in Buttons.BUTTONS.keys():
             self._state[button] = False
+        self._word = 0
+        self._pressed_at = {}
         self._callbacks = []
+        self._hold_callbacks = []
 
     def __len__(self):
         return len(self._state)
@@ -173,37 +1263,83 @@ class Buttons(object):
         return repr(self._state)
 
     def __getitem__(self, btn):
-        if self._state.has_key(btn):
+        if btn in self._state:
             return self._state[btn]
         else:
             raise KeyError(str(btn))
 
-    def register_callback(self, func):
-        self._callbacks.append(func)
-    
+    def register_callback(self, func, policy=DIRECT, batch_size=None):
+        """
+        Calls func(state) for every new state, see CallbackDispatcher for the
+        *policy* options.
+        """
+        self._callbacks.append(self._wiimote.dispatcher.wrap(func, policy, batch_size))
+
     def unregister_callback(self, func):
         if func in self._callbacks:
             self._callbacks.remove(func)
+            self._wiimote.dispatcher.unwrap(func)
+
+    def register_hold_callback(self, func, hold_time=0.5, repeat=None):
+        """
+        Calls func(button, pressed_at, held_for) once *button* has been held
+        down for *hold_time* seconds and, if *repeat* is given, every *repeat*
+        seconds after that until it is released. *pressed_at* is the receive
+        time of the press, in the same clock as the sensor histories.
+        Hold events are checked whenever a report arrives, so reports are
+        sent continuously while there are hold callbacks.
+        """
+        self._hold_callbacks.append([func, hold_time, repeat, {}])
+        self._wiimote._update_report_mode()
+
+    def unregister_hold_callback(self, func):
+        for subscriber in self._hold_callbacks[:]:
+            if subscriber[0] == func:
+                self._hold_callbacks.remove(subscriber)
+        self._wiimote._update_report_mode()
 
     def _notify_callbacks(self, diff):
         for callback in self._callbacks:
             callback(diff)
 
     def handle_report(self, report):
-        btn_bytes = (report[1] << 8) + report[2]
-        new_state = {}
-        for btn, mask in Buttons.BUTTONS.items():
-            new_state[btn] = bool(mask & btn_bytes)
-        diff = self._update_state(new_state)
-        self._notify_callbacks(diff)
-
-    def _update_state(self, new_state):
-        diff = []
-        for btn, state in new_state.items():
-            if self._state[btn] != state:
-                diff.append((btn, state))
-                self._state[btn] = state
-        return diff
+        btn_word = ((report[1] << 8) + report[2]) & Buttons.BUTTON_MASK
+        changed = btn_word ^ self._word
+        if changed:
+            self._word = btn_word
+            now = self._com.report_time
+            diff = []
+            for mask, btn in Buttons.MASK_TABLE:
+                if changed & mask:
+                    state = bool(btn_word & mask)
+                    self._state[btn] = state
+                    diff.append((btn, state))
+                    self._update_hold_timers(btn, state, now)
+            self._notify_callbacks(diff)
+        if self._pressed_at and self._hold_callbacks:
+            self._check_hold_timers(self._com.report_time)
+
+    def _update_hold_timers(self, btn, pressed, now):
+        if pressed:
+            self._pressed_at[btn] = now
+        else:
+            self._pressed_at.pop(btn, None)
+        for func, hold_time, repeat, due in self._hold_callbacks:
+            if pressed:
+                due[btn] = now + hold_time
+            else:
+                due.pop(btn, None)
+
+    def _check_hold_timers(self, now):
+        for func, hold_time, repeat, due in self._hold_callbacks:
+            for btn, due_at in list(due.items()):
+                if now >= due_at:
+                    if repeat:
+                        due[btn] = due_at + repeat
+                    else:
+                        del due[btn]
+                    pressed_at = self._pressed_at[btn]
+                    func(btn, pressed_at, now - pressed_at)
                     
 
 class LEDs(object):
@@ -235,12 +1371,11 @@ class LEDs(object):
     def set_leds(self, led_list):
         for led_no, val in enumerate(led_list):
             self._state[led_no] = True if val else False
-        RPT_LED = 0x11
         led_byte = 0x00
         for val, state in zip([0x10, 0x20, 0x40, 0x80], self._state):
             if state:
                led_byte += val
-        self._com._send(RPT_LED, led_byte)
+        self._com.set_leds(led_byte)
 
 class Rumbler(object):
 
@@ -257,7 +1392,12 @@ class Rumbler(object):
         t.start()
         self.set_rumble(True)
 
-class IRCam(object):
+class IRCam(_Sensor):
+    """
+    The IR camera. It tracks up to four objects, the state is a (4, 4)
+    array, see state. Batch callbacks get (N, 4, 3) blocks with x, y and
+    size of all four slots; empty slots have x == y == 1023.
+    """
 
     MODE_BASIC = 1
     MODE_EXTENDED = 3
@@ -275,125 +1415,770 @@ class IRCam(object):
     
     SUPPORTED_REPORTS = [0x33, 0x36,0x37,0x3e,0x3f]
 
+    # output reports that switch the camera's pixel clock and the camera on
+    RPT_ENABLE = 0x13
+    RPT_ENABLE_2 = 0x1a
+    # each initialization step waits this long for its acknowledgement and
+    # is repeated up to INIT_RETRIES times
+    INIT_TIMEOUT = 0.25 # seconds
+    INIT_RETRIES = 3
+
+    # data reporting mode used for each camera mode
+    REPORT_MODES = {MODE_BASIC: 0x37, MODE_EXTENDED: 0x33, MODE_FULL: 0x3e}
+    # offset of the IR bytes within each report
+    DATA_OFFSETS = {0x33: 6, 0x36: 3, 0x37: 6, 0x3e: 4, 0x3f: 4}
+
+    # columns of the state array
+    FIELDS = ('x', 'y', 'size', 'intensity')
+
+    # All four slots are recorded, empty ones have x == y == 1023.
+    # Size is 0 in basic mode, intensity and bbox (x_min, y_min, x_max,
+    # y_max) are only reported in full mode.
+    HISTORY_DTYPE = [('time', 'f8'), ('x', 'i2', (4,)), ('y', 'i2', (4,)),
+                     ('size', 'i2', (4,)), ('intensity', 'i2', (4,)),
+                     ('bbox', 'i2', (4, 4))]
+
+    _copy_state = True
+    _change_filter = _IRChangeFilter
+
     def __init__(self, wiimote):
+        _Sensor.__init__(self, wiimote)
         self.wiimote = wiimote
-        self._com = wiimote._com
-        self._state = []
-        self._callbacks = []
+        # One row (x, y, size, intensity) per slot, rows of empty slots are
+        # -1. Updated in place; consumers only get read-only views.
+        self._state = np.full((4, 4), -1, np.int16)
+        self._valid = np.zeros(4, bool)
+        self._invalid = np.zeros((4, 1), bool) # for masking whole rows
+        self._bbox = np.zeros((4, 4), np.int16)
+        self._state_view = self._state.view()
+        self._state_view.flags.writeable = False
+        self._valid_view = self._valid.view()
+        self._valid_view.flags.writeable = False
+        self._first_half = None # objects 0 and 1 of a full mode frame
         self._mode = self.MODE_EXTENDED
+        # the mode the camera runs in, see _update_camera_mode()
+        self._camera_mode = self._mode
         self._sensitivity = 3
-        self.set_mode_sensitivity(self._mode, self._sensitivity)
+        self._powered = False
+        self._init_lock = threading.Lock()
 
     def __len__(self):
+        """
+        Number of slots (4), like indexing and iteration. Use valid to see
+        which of them hold an object.
+        """
         return len(self._state)
 
+    @property
+    def state(self):
+        """
+        Read-only (4, 4) array with an (x, y, size, intensity) row per slot,
+        rows of empty slots are -1. Updated in place.
+        """
+        self._poll()
+        return self._state_view
+
+    @property
+    def valid(self):
+        """ Read-only mask of the slots holding an object. """
+        self._poll()
+        return self._valid_view
+
+    def report_mode(self, with_accelerometer):
+        """
+        The smallest reporting mode for the current camera mode. The basic
+        mode ones (0x36, 0x37) carry extension data as well.
+        """
+        if self._camera_mode == self.MODE_BASIC and not with_accelerometer:
+            return 0x36
+        return self.REPORT_MODES[self._camera_mode]
+
+    def _update_camera_mode(self, with_extension):
+        # Extension data only fits into the basic mode reports, so the
+        # camera falls back to basic mode while an extension is used.
+        # Changing the mode needs a new initialization.
+        mode = self.MODE_BASIC if with_extension else self._mode
+        if mode != self._camera_mode:
+            if mode != self._mode:
+                _debug("IR camera in basic mode while the extension is used")
+            self._camera_mode = mode
+            self._first_half = None
+            self._powered = False
+
     def __repr__(self):
-        return repr(self._state)
+        # without switching the camera on, unlike reading the state
+        return repr(self.as_dicts(self._state_view))
 
     def __getitem__(self, slot):
-        if 0 <= slot < len(self._state):
-            return self._state[slot]
+        """ The (x, y, size, intensity) row of *slot* (0-3). """
+        if 0 <= slot < 4:
+            return self.state[slot]
         else:
             raise IndexError("list index out of range")
 
     def set_mode_sensitivity(self, mode, sensitivity):
+        """
+        Sets the camera mode and sensitivity. They are applied right away if
+        the camera is on, otherwise once it is needed. While extension data
+        is needed as well, the camera runs in basic mode.
+        """
         if sensitivity > len(self.SENSITIVITY_BLOCKS) - 1 or \
            (mode not in [self.MODE_BASIC, self.MODE_EXTENDED, self.MODE_FULL]):
             raise TypeError("wrong mode or sensitivity level given")
-        self._com.set_report_mode(0x33) #todo: adjust for other modes!!
-        self._com._send(0x13, 0x04)
-        self._com._send(0x1a, 0x04)
-        self.wiimote.memory.write(0xb00030, 0x08, eeprom=False)
-        self.wiimote.memory.write(0xb00000, self.SENSITIVITY_BLOCKS[mode][0], eeprom=False)
-        self.wiimote.memory.write(0xb0001a, self.SENSITIVITY_BLOCKS[mode][1], eeprom=False)
-        self.wiimote.memory.write(0xb00033, mode, eeprom=False)
+        self._mode = self._camera_mode = mode
+        self._sensitivity = sensitivity
+        self._first_half = None
+        if self._powered:
+            self._powered = False # initialize again
+            return self.wiimote._update_report_mode()
+
+    def _power_up(self):
+        # expects the reporting mode to be set already; returns an
+        # awaitable with wiimote_async
+        self._powered = True
+        self._first_half = None
+        return self._initialize()
+
+    def _init_steps(self):
+        # the sequence from WiiBrew as (function, args) steps, each of them
+        # acknowledged by the Wiimote
+        memory = self.wiimote.memory
+        block_1, block_2 = self.SENSITIVITY_BLOCKS[self._sensitivity]
+        return [(memory.send_acknowledged, (self.RPT_ENABLE, 0x04)),
+                (memory.send_acknowledged, (self.RPT_ENABLE_2, 0x04)),
+                (memory.write, (0xb00030, 0x08)),
+                (memory.write, (0xb00000, block_1)),
+                (memory.write, (0xb0001a, block_2)),
+                (memory.write, (0xb00033, self._camera_mode)),
+                (memory.write, (0xb00030, 0x08))]
+
+    def _initialize(self):
+        """
+        Runs the initialization steps one after the other. A step that is
+        not acknowledged within INIT_TIMEOUT is repeated, up to
+        INIT_RETRIES times; then the camera is left off and initialized
+        again the next time the reporting mode is updated. Returns whether
+        the camera is ready.
+        """
+        with self._init_lock:
+            try:
+                self.wiimote.memory._check_thread()
+                ready = self._run_init_steps()
+            except Exception:
+                self._powered = False
+                raise
+            if not ready:
+                self._powered = False
+            return ready
+
+    def _run_init_steps(self):
+        started = _monotonic()
+        for func, args in self._init_steps():
+            for attempt in range(self.INIT_RETRIES + 1):
+                try:
+                    func(*args, timeout=self.INIT_TIMEOUT)
+                    break
+                except RuntimeError as e:
+                    self._step_failed(e, attempt)
+            else:
+                return False
+        self._initialized(started)
+        return True
 
-    def disable(self):
-        pass
+    def _step_failed(self, error, attempt):
+        _debug("IR initialization step failed (attempt %d): %s" % (attempt + 1, error))
+        if self._com.telemetry is not None and attempt < self.INIT_RETRIES:
+            self._com.telemetry.retries += 1
+
+    def _initialized(self, started):
+        if self._com.telemetry is not None:
+            self._com.telemetry.durations['ir_init'] = _monotonic() - started
+
+    def _power_down(self):
+        self._powered = False
+        self._com._send(self.RPT_ENABLE, 0x00)
+        self._com._send(self.RPT_ENABLE_2, 0x00)
 
     def get_state(self):
-        return self._state
+        return self.state
+
+    def as_dicts(self, state=None):
+        """
+        Returns the visible objects of *state* (default: the current state)
+        as a list of dicts with 'id', 'x', 'y' and 'size', plus 'intensity'
+        and 'bbox' in full mode, like earlier versions of this module did.
+        """
+        state = self.state if state is None else state
+        objects = []
+        for ir_obj in np.flatnonzero(state[:, 0] >= 0):
+            x, y, size, intensity = state[ir_obj].tolist()
+            obj = {'id': int(ir_obj), 'x': x, 'y': y, 'size': size}
+            if self._camera_mode == self.MODE_FULL:
+                obj['intensity'] = intensity
+                obj['bbox'] = tuple(self._bbox[ir_obj].tolist())
+            objects.append(obj)
+        return objects
 
     def set_sensitivity(self, sensitivity):
-        self.set_mode_sensitivity(self._mode, sensitivity) 
+        return self.set_mode_sensitivity(self._mode, sensitivity)
+
+    def register_callback(self, func, policy=DIRECT, batch_size=None,
+                          as_dicts=False, deadband=None, heartbeat_ms=None):
+        """
+        Calls func(state) for every new state, see CallbackDispatcher for the
+        *policy* options. *state* is a read-only (4, 4) array, see
+        IRCam.state. It is updated in place, so copy it to keep it. With
+        *as_dicts*, func gets a list of dicts instead, see as_dicts().
+        *deadband* and *heartbeat_ms* work as for the accelerometer, on all
+        values of the state; objects appearing or disappearing always
+        count as a change.
+        """
+        if as_dicts:
+            func = _DictCallback(self, func)
+        return self._add_callback(func, policy, batch_size, deadband,
+                                  heartbeat_ms)
+
+    @staticmethod
+    def _batch_array(samples):
+        return np.stack((samples['x'], samples['y'], samples['size']), axis=-1)
 
-    def register_callback(self, func):
-        self._callbacks.append(func)
-    
-    def unregister_callback(self, func):
-        if func in self._callbacks:
-            self._callbacks.remove(func)
+    def handle_report(self, report):
+        rpt_type = report[0]
+        assert(rpt_type in self.SUPPORTED_REPORTS)
+        offset = self.DATA_OFFSETS[rpt_type]
+        if rpt_type in [0x36, 0x37]:
+            raw = np.frombuffer(report, np.uint8, 10, offset)
+            self._update(*self._decode_basic(raw.astype(np.int16)))
+        elif rpt_type == 0x33:
+            raw = np.frombuffer(report, np.uint8, 12, offset)
+            self._update(*self._decode_extended(raw.astype(np.int16)))
+        elif rpt_type == 0x3e:
+            # objects 0 and 1, wait for the second half of the frame
+            self._first_half = np.frombuffer(report, np.uint8, 18, offset).copy()
+        elif self._first_half is not None:
+            raw = np.empty(36, np.int16)
+            raw[:18] = self._first_half
+            raw[18:] = np.frombuffer(report, np.uint8, 18, offset)
+            self._first_half = None
+            self._update(*self._decode_full(raw))
+
+    # The decoders get the IR bytes of a report as an int16 array and
+    # decode all four objects at once. They return x, y, size, intensity
+    # and bbox arrays.
+
+    @staticmethod
+    def _decode_basic(raw):
+        # two blocks of 5 bytes, each holding two objects
+        raw = raw.reshape(2, 5)
+        high = raw[:, 2]
+        x = np.column_stack((raw[:, 0] | ((high & 0b00110000) << 4),
+                             raw[:, 3] | ((high & 0b00000011) << 8))).ravel()
+        y = np.column_stack((raw[:, 1] | ((high & 0b11000000) << 2),
+                             raw[:, 4] | ((high & 0b00001100) << 6))).ravel()
+        zeros = np.zeros(4, np.int16)
+        return x, y, zeros, zeros, np.zeros((4, 4), np.int16)
+
+    @staticmethod
+    def _decode_extended(raw):
+        raw = raw.reshape(4, 3)
+        flags = raw[:, 2]
+        x = raw[:, 0] | ((flags & 0b00110000) << 4)
+        y = raw[:, 1] | ((flags & 0b11000000) << 2)
+        size = flags & 0b00001111
+        zeros = np.zeros(4, np.int16)
+        return x, y, size, zeros, np.zeros((4, 4), np.int16)
+
+    @staticmethod
+    def _decode_full(raw):
+        # extended format followed by bounding box and intensity
+        raw = raw.reshape(4, 9)
+        x, y, size = IRCam._decode_extended(raw[:, :3].ravel())[:3]
+        bbox = raw[:, 3:7] & 0b01111111
+        return x, y, size, raw[:, 8], bbox
+
+    def _update(self, x, y, size, intensity, bbox):
+        valid = self._valid
+        np.not_equal(x, 1023, out=valid)
+        valid |= (y != 1023)
+        if self._camera_mode != self.MODE_BASIC:
+            valid &= (size != 0)
+        state = self._state
+        state[:, 0] = x
+        state[:, 1] = y
+        state[:, 2] = size
+        state[:, 3] = intensity
+        # (state[~valid] = -1 would allocate several KB of buffers)
+        np.logical_not(valid, out=self._invalid[:, 0])
+        np.copyto(state, -1, where=self._invalid)
+        self._bbox[:] = bbox
+        self.history.append((self._com.report_time, x, y, size, intensity, bbox))
+        self._notify_callbacks(self._state_view)
+
+class _DictCallback(_FuncWrapper):
+    """ Passes IRCam states to *func* as lists of dicts. """
+
+    def __init__(self, ir, func):
+        _FuncWrapper.__init__(self, func)
+        self._ir = ir
+
+    def __call__(self, state):
+        self.func(self._ir.as_dicts(state))
+
+
+class Extension(object):
+    """
+    The extension port. Status reports tell when an extension is plugged
+    in or removed; it is then initialized and identified in the
+    background, and its data is decoded by wiimote.nunchuk or
+    wiimote.motionplus. *type* is None while the port is empty, otherwise
+    one of 'nunchuk', 'motionplus', 'classic' or 'unknown'.
+    """
 
-    def _notify_callbacks(self):
-        for callback in self._callbacks:
-            callback(self._state)
+    RPT_STATUS = 0x20
+    STATUS_CONNECTED = 0x02
+
+    SUPPORTED_REPORTS = [RPT_STATUS, 0x32, 0x34, 0x35, 0x36, 0x37, 0x3d]
+
+    # offset of the extension bytes within each report
+    DATA_OFFSETS = {0x32: 3, 0x34: 3, 0x35: 6, 0x36: 13, 0x37: 16, 0x3d: 1}
+
+    # disables the encryption of extension data
+    INIT_BLOCKS = [(0xa400f0, 0x55), (0xa400fb, 0x00)]
+    ID_ADDRESS = 0xa400fa
+    ID_SIZE = 6
+    # bytes 2-5 of the identifier
+    TYPES = {(0xa4, 0x20, 0x00, 0x00): 'nunchuk',
+             (0xa4, 0x20, 0x01, 0x01): 'classic',
+             (0xa4, 0x20, 0x04, 0x05): 'motionplus',
+             (0xa4, 0x20, 0x05, 0x05): 'motionplus', # Nunchuk passthrough
+             (0xa4, 0x20, 0x07, 0x05): 'motionplus'} # Classic passthrough
+
+    def __init__(self, wiimote):
+        self.wiimote = wiimote
+        self._com = wiimote._com
+        self.connected = False
+        self.type = None
+        self._device = None # the sensor decoding the extension bytes
+        self._extension_only = False
+        self._motionplus_activated = False
+
+    @property
+    def active(self):
+        """ Whether a subscriber needs data of the connected extension. """
+        device = self._device
+        return device is not None and device.active
+
+    def set_extension_only(self, enabled=True):
+        """
+        Uses report 0x3d (extension data only, no buttons) while neither
+        the accelerometer nor the IR camera are needed.
+        """
+        self._extension_only = enabled
+        self.wiimote._update_report_mode()
+
+    def report_mode(self, with_accelerometer):
+        """ The smallest reporting mode with extension data. """
+        if with_accelerometer:
+            return 0x35
+        return 0x3d if self._extension_only else 0x32
+
+    def initialize(self):
+        """
+        Initializes the connected extension and finds out its type. Blocks
+        until done; called automatically when an extension is plugged in.
+        """
+        memory = self.wiimote.memory
+        try:
+            if not self._motionplus_activated:
+                memory.write_blocks(self.INIT_BLOCKS)
+            identifier = memory.read(self.ID_ADDRESS, self.ID_SIZE)
+        except RuntimeError as e:
+            _debug("initializing the extension failed: %s" % e)
+            identifier = None
+        self._identify(identifier)
+
+    def _identify(self, identifier):
+        if not self.connected:
+            return # unplugged in the meantime
+        if identifier is None:
+            self.type = 'unknown'
+        else:
+            self.type = self.TYPES.get(tuple(identifier[2:6]), 'unknown')
+        self._device = {'nunchuk': self.wiimote.nunchuk,
+                        'motionplus': self.wiimote.motionplus}.get(self.type)
 
     def handle_report(self, report):
-        assert(report[0] in self.SUPPORTED_REPORTS)
-        # only extended mode for now!
-        ir_data = report[6:]
-        self._state = []
-        for ir_obj in range(4):
-            data = ir_data[ir_obj*3:(ir_obj+1)*3]
-            x = data[0] + ((data[2] & 0b00110000) << 4)
-            y = data[1] + ((data[2] & 0b11000000) << 2)
-            size = data[2] & 0b00001111
-            if size != 0:
-                self._state.append({'id': ir_obj, 'x': x, 'y': y, 'size': size})
-        self._notify_callbacks()
+        if report[0] == self.RPT_STATUS:
+            self._handle_status(report)
+            return
+        device = self._device
+        if device is not None:
+            device._decode(report, self.DATA_OFFSETS[report[0]])
+
+    def _reset(self):
+        # the Wiimote has forgotten the extension's initialization
+        self.connected = False
+        self.type = None
+        self._device = None
+        self._motionplus_activated = False
+
+    def _handle_status(self, report):
+        # A status report also stops data reports until the reporting mode
+        # is set again, so the WiiMote has to answer every one of them.
+        connected = bool(report[3] & self.STATUS_CONNECTED)
+        plugged_in = connected and not self.connected
+        if connected != self.connected:
+            self.connected = connected
+            self.type = None
+            self._device = None
+            if not connected:
+                self._motionplus_activated = False
+        self.wiimote._status_received(plugged_in)
+
+
+class _ExtensionDevice(_Sensor):
+    # the sensors behind the extension port, with data while connected
+
+    def __init__(self, wiimote):
+        _Sensor.__init__(self, wiimote)
+        self._state = None
+
+    def __repr__(self):
+        return repr(self._state)
+
+    @property
+    def state(self):
+        """ The latest state, None before the first one has arrived. """
+        self._poll()
+        return self._state
+
+    def _data_expected(self):
+        return self._wiimote.extension.active
+
+
+class Nunchuk(_ExtensionDevice, _Calibrated):
+    """
+    Stick, accelerometer and buttons of a Nunchuk. The state is a dict with
+    'stick' (x, y), 'acc' [x, y, z] (raw, like Accelerometer) and 'C' and
+    'Z' button states. Batch callbacks get (N, 3) accelerometer blocks.
+    """
+
+    HISTORY_DTYPE = [('time', 'f8'), ('stick_x', 'u1'), ('stick_y', 'u1'),
+                     ('x', 'i2'), ('y', 'i2'), ('z', 'i2'),
+                     ('button_c', '?'), ('button_z', '?')]
+
+    # typical raw values for 0 g and 1 g (the calibration is not read)
+    DEFAULT_CALIBRATION = ([512, 512, 512], [716, 716, 716])
+
+    def __init__(self, wiimote):
+        _ExtensionDevice.__init__(self, wiimote)
+        self._set_calibration(*self.DEFAULT_CALIBRATION)
+
+    def _decode(self, report, offset):
+        stick_x, stick_y = report[offset], report[offset + 1]
+        low = report[offset + 5]
+        x = (report[offset + 2] << 2) | ((low >> 2) & 0x03)
+        y = (report[offset + 3] << 2) | ((low >> 4) & 0x03)
+        z = (report[offset + 4] << 2) | ((low >> 6) & 0x03)
+        # buttons are active low
+        c = not (low & 0x02)
+        z_button = not (low & 0x01)
+        self._state = {'stick': (stick_x, stick_y), 'acc': [x, y, z],
+                       'C': c, 'Z': z_button}
+        self.history.append((self._com.report_time, stick_x, stick_y,
+                             x, y, z, c, z_button))
+        self._notify_callbacks(self._state)
+
+
+class MotionPlus(_ExtensionDevice):
+    """
+    Gyroscope of a Wii MotionPlus. The state is a list of raw [yaw, pitch,
+    roll] rates (14 bit, about 8192 at rest). An inactive MotionPlus has to
+    be switched on with activate() before it shows up as the extension;
+    extensions plugged into it are not passed through.
+
+    For 6-DoF data, enable the accelerometer as well: reports 0x35 and 0x37
+    carry both, and every history record holds the raw accelerometer
+    values of its report ('acc', zero for reports without them). Batch
+    callbacks get (N, 6) float32 blocks of x, y, z in g and yaw, pitch,
+    roll in degrees per second.
+    """
+
+    HISTORY_DTYPE = [('time', 'f8'), ('yaw', 'i2'), ('pitch', 'i2'),
+                     ('roll', 'i2'), ('slow', '?', (3,)), ('acc', 'i2', (3,))]
+
+    PROBE_ADDRESS = 0xa600fa
+    ACTIVATE_BLOCKS = [(0xa600f0, 0x55), (0xa600fe, 0x04)]
+    DEACTIVATE_BLOCKS = [(0xa400f0, 0x55)]
+
+    # degrees per second per raw unit in slow and fast mode
+    SLOW_SCALE = 595.0 / 8192
+    FAST_SCALE = SLOW_SCALE * 2000.0 / 440
+    ZERO = 8192
+
+    def __init__(self, wiimote):
+        _ExtensionDevice.__init__(self, wiimote)
+        self.zero = np.full(3, self.ZERO, np.float32) # raw rates at rest
+        self.slow = [True, True, True]
+        self._no_acc = (0, 0, 0)
+
+    def activate(self):
+        """
+        Switches on a MotionPlus that is not active yet. Returns False if
+        there is none. Blocks, so it must not be called from a callback.
+        """
+        memory = self._wiimote.memory
+        try:
+            identifier = memory.read(self.PROBE_ADDRESS, Extension.ID_SIZE)
+        except RuntimeError:
+            return False
+        if not self._probe_found(identifier):
+            return False
+        self._wiimote.extension._motionplus_activated = True
+        memory.write_blocks(self.ACTIVATE_BLOCKS)
+        return True
+
+    @staticmethod
+    def _probe_found(identifier):
+        # an inactive MotionPlus answers at PROBE_ADDRESS
+        return tuple(identifier[2:4]) == (0xa6, 0x20)
+
+    def deactivate(self):
+        """ Switches the MotionPlus off again. """
+        self._wiimote.extension._motionplus_activated = False
+        self._wiimote.memory.write_blocks(self.DEACTIVATE_BLOCKS)
+
+    def to_deg_per_s(self, samples):
+        """
+        Converts history records to an (N, 3) float32 array of yaw, pitch
+        and roll rates in degrees per second.
+        """
+        raw = np.column_stack((samples['yaw'], samples['pitch'], samples['roll']))
+        scale = np.where(samples['slow'], self.SLOW_SCALE, self.FAST_SCALE)
+        return ((raw.astype(np.float32) - self.zero) * scale).astype(np.float32)
+
+    def _batch_array(self, samples):
+        return np.column_stack((self._wiimote.accelerometer.to_g(samples['acc']),
+                                self.to_deg_per_s(samples)))
+
+    def _decode(self, report, offset):
+        if not report[offset + 5] & 0x02:
+            return # data of a passthrough extension
+        b3, b4, b5 = report[offset + 3], report[offset + 4], report[offset + 5]
+        yaw = report[offset] | ((b3 & 0xfc) << 6)
+        roll = report[offset + 1] | ((b4 & 0xfc) << 6)
+        pitch = report[offset + 2] | ((b5 & 0xfc) << 6)
+        self.slow = [bool(b3 & 0x02), bool(b3 & 0x01), bool(b4 & 0x02)]
+        self._state = [yaw, pitch, roll]
+        if report[0] in (0x35, 0x37):
+            acc = self._wiimote.accelerometer._state # decoded from this report
+        else:
+            acc = self._no_acc
+        self.history.append((self._com.report_time, yaw, pitch, roll,
+                             self.slow, acc))
+        self._notify_callbacks(self._state)
+
 
 class Memory(object):
+    """
+    Reads and writes the Wiimote's EEPROM and control registers.
+
+    Both read() and write() block until the Wiimote has answered (with
+    0x21 data reports or 0x22 acknowledgements) and raise a RuntimeError
+    if that does not happen within *timeout* seconds. They must not be
+    called from a callback, as callbacks run on the thread that receives
+    the replies.
+    """
 
     RPT_READ = 0x17
     RPT_WRITE = 0x16
+    RPT_READ_DATA = 0x21
+    RPT_ACK = 0x22
+    # set in the first byte of an output report to have it acknowledged
+    ACK_REQUEST = 0x02
     
-    SUPPORTED_REPORTS = [0x21]
+    SUPPORTED_REPORTS = [RPT_READ_DATA, RPT_ACK]
+
+    MAX_WRITE_SIZE = 16
+    TIMEOUT = 1.0 # seconds
+    # number of write requests sent ahead before waiting for an ack
+    MAX_PENDING_WRITES = 4
 
     def __init__(self, wiimote):
         self.wiimote = wiimote
         self._com = wiimote._com
+        self.timeout = Memory.TIMEOUT
+        self.max_pending_writes = Memory.MAX_PENDING_WRITES
+        self._transaction_lock = threading.Lock() # one request at a time
+        self._reply = threading.Condition()
         self._request_in_progress = False
-        self._bytes_requested = 0
-        self._reply_buffer = []
-
-
-    def write(self, address, data, eeprom=False):
-        # to do: send larger blocks in multiple 16-byte requests instead of failing
+        self._bytes_remaining = 0
+        self._pending_writes = 0
+        self._awaited_ack = None # output report id, see send_acknowledged()
+        self._error = None
+        self._reply_buffer = bytearray()
+
+    def write(self, address, data, eeprom=False, timeout=None):
+        """
+        Writes *data* (a byte or a - possibly nested - list of bytes) to
+        *address*. Data longer than 16 bytes is split into several requests.
+        """
+        self.write_blocks([(address, data)], eeprom, timeout)
+
+    def write_blocks(self, blocks, eeprom=False, timeout=None):
+        """
+        Writes a list of (address, data) blocks in one go. Up to
+        max_pending_writes requests are sent before the first
+        acknowledgement has to arrive, so a series of writes costs about
+        one round-trip instead of one per request.
+        """
+        chunks = self._split_blocks(blocks)
+        timeout = self.timeout if timeout is None else timeout
+        with self._transaction_lock:
+            self._check_thread()
+            with self._reply:
+                self._error = None
+                self._pending_writes = 0
+            for address, bytes_to_send in chunks:
+                with self._reply:
+                    self._wait_for(lambda: self._pending_writes < self.max_pending_writes,
+                                   timeout, "Memory write at 0x%06x" % address)
+                    self._pending_writes += 1
+                self._send_write(address, bytes_to_send, eeprom)
+            with self._reply:
+                self._wait_for(lambda: self._pending_writes == 0, timeout,
+                               "Memory write")
+
+    @staticmethod
+    def _split_blocks(blocks):
+        # one (address, bytes) chunk per write request
+        chunks = []
+        for address, data in blocks:
+            bytes_to_send = _to_byte_list(data)
+            for offset in range(0, len(bytes_to_send), Memory.MAX_WRITE_SIZE):
+                chunks.append((address + offset,
+                               bytes_to_send[offset:offset + Memory.MAX_WRITE_SIZE]))
+        return chunks
+
+    def _send_write(self, address, bytes_to_send, eeprom):
         address_bytes = _val_to_byte_list(address, 3, big_endian=True)
-        bytes_to_send = _flatten(data)
         amount = len(bytes_to_send)
         amount_byte = _val_to_byte_list(amount, 1, big_endian=True)
-        bytes_to_send = _add_padding(bytes_to_send, 16)
+        bytes_to_send = _add_padding(bytes_to_send, Memory.MAX_WRITE_SIZE)
         control_or_eeprom = 0x00 if eeprom else 0x04
         self._com._send(Memory.RPT_WRITE, control_or_eeprom, address_bytes, amount_byte, bytes_to_send) 
 
-    def read(self, address, amount, eeprom=False):
-        if self._request_in_progress:
-            raise RuntimeError("Memory read already in progress.")
+    def send_acknowledged(self, rpt, data, timeout=None):
+        """
+        Sends output report *rpt* with the payload *data* (a byte or a list
+        of bytes) and waits until the Wiimote has acknowledged it.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        with self._transaction_lock:
+            self._check_thread()
+            with self._reply:
+                self._error = None
+                self._awaited_ack = rpt
+            self._send_acknowledged(rpt, data)
+            with self._reply:
+                try:
+                    self._wait_for(lambda: self._awaited_ack is None, timeout,
+                                   "Acknowledgement of report 0x%02x" % rpt)
+                finally:
+                    self._awaited_ack = None
+
+    def _send_acknowledged(self, rpt, data):
+        payload = _to_byte_list(data)
+        payload[0] |= Memory.ACK_REQUEST
+        self._com._send(rpt, payload)
+
+    def read(self, address, amount, eeprom=False, timeout=None):
+        """
+        Reads *amount* bytes (up to 65535) starting at *address* and returns
+        them as a list of ints. The Wiimote answers a single request with as
+        many 16 byte reports as needed.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        with self._transaction_lock:
+            self._check_thread()
+            with self._reply:
+                self._start_read(amount)
+            self._send_read(address, amount, eeprom)
+            # now wait until handle_report() has filled our reply buffer
+            with self._reply:
+                try:
+                    self._wait_for(lambda: not self._request_in_progress, timeout,
+                                   "Memory read at 0x%06x" % address)
+                finally:
+                    self._request_in_progress = False
+                return list(self._reply_buffer)
+
+    def _start_read(self, amount):
+        self._error = None
         self._bytes_remaining = amount
+        self._reply_buffer = bytearray()
+        self._request_in_progress = True
+
+    def _send_read(self, address, amount, eeprom):
         address_bytes = _val_to_byte_list(address, 3, big_endian=True)
         amount_bytes = _val_to_byte_list(amount, 2, big_endian=True)
-        control_or_eeprom = 0x00 if eeprom else 0x02
-        self._request_in_progress = True
-        self._reply_buffer = []
+        control_or_eeprom = 0x00 if eeprom else 0x04
         self._com._send(Memory.RPT_READ, control_or_eeprom, address_bytes, amount_bytes) 
-        # now wait until handle() has filled our reply buffer
-        while self._request_in_progress:
-            time.sleep(0.01)
-        return self._reply_buffer
+
+    def _check_thread(self):
+        if self._com.on_receive_thread():
+            raise RuntimeError("Memory can not be accessed from a callback.")
+
+    def _wait_for(self, predicate, timeout, what):
+        # must be called with self._reply acquired
+        deadline = _monotonic() + timeout
+        while not predicate() and self._error is None:
+            remaining = deadline - _monotonic()
+            if remaining <= 0:
+                raise RuntimeError("%s timed out after %.2f s." % (what, timeout))
+            self._reply.wait(remaining)
+        if self._error is not None:
+            raise RuntimeError(self._error)
 
     def handle_report(self, report):
         if report[0] not in Memory.SUPPORTED_REPORTS: # interleaved modes
             raise NotImplementedError("can not handle this report")
+        with self._reply:
+            self._update(report)
+            self._reply.notify_all()
+
+    def _update(self, report):
+        # errors are passed on to the waiting caller instead of being raised
+        # here, which would end the receive thread
+        if report[0] == Memory.RPT_ACK:
+            self._handle_ack(report)
+        elif self._request_in_progress:
+            self._handle_read_data(report)
+
+    def _handle_ack(self, report):
+        if self._awaited_ack is not None and report[3] == self._awaited_ack:
+            self._awaited_ack = None
+            if report[4] != 0:
+                self._error = "Error condition %x received for report 0x%02x!" % (
+                    report[4], report[3])
+            return
+        if report[3] != Memory.RPT_WRITE or self._pending_writes == 0:
+            return # ack for another output report
+        self._pending_writes -= 1
+        if report[4] != 0:
+            self._error = "Error condition %x received during memory write!" % report[4]
+
+    def _handle_read_data(self, report):
         error = (report[3] & 0x0f) 
         if error != 0:
-            raise RuntimeError("Error condition %x received during memory read!" % error)
+            self._error = "Error condition %x received during memory read!" % error
+            return
         num_bytes_received = ((report[3] >> 4) & 0x0f) + 1
-        data_bytes = report[6:][:num_bytes_received]
-        self._reply_buffer += data_bytes
+        # copies straight from the receive buffer, no intermediate list
+        self._reply_buffer += memoryview(report)[6:6 + num_bytes_received]
         self._bytes_remaining -= num_bytes_received
         if self._bytes_remaining < 0:
-            raise RuntimeError("Memory read received more data than requested!")
+            self._error = "Memory read received more data than requested!"
         elif self._bytes_remaining == 0:
             self._request_in_progress = False
 
@@ -404,20 +2189,58 @@ class CommunicationHandler(threading.Thread):
     MODE_ACC     = 0x31
     MODE_ACC_IR  = 0x33
 
+    RPT_RUMBLE     = 0x10
+    RPT_LED        = 0x11
+    RPT_MODE       = 0x12
     RPT_STATUS_REQ = 0x15
 
+    # input reports are at most 22 bytes plus the 0xa1 transaction header
+    REPORT_BUFFER_SIZE = 32
+
+    # status, memory read and acknowledge reports arrive in every mode
+    RPT_ALWAYS_EXPECTED = [0x20, 0x21, 0x22]
+    # interleaved modes alternate between two report ids
+    RPT_MODE_PAIRS = {0x3e: [0x3e, 0x3f], 0x3f: [0x3e, 0x3f]}
+
     def __init__(self, wiimote):
         threading.Thread.__init__(self)
         self.daemon = True
         self.rumble = False # rumble always 
+        # Output state (LEDs, rumble, report mode) is changed through
+        # _set_output(). Changes wait in the batch of their thread while a
+        # batch() is open there, and in _pending while the link is down.
+        # They are compared against _sent, the state the Wiimote already
+        # has, so that a flush sends as few reports as possible.
+        self._output_lock = threading.RLock()
+        self._batches = threading.local()
+        self._pending = {}
+        self._sent = {}
+        self._link_down = False # while reconnecting
+        self._stopping = threading.Event()
         self.wiimote = wiimote
         self.btaddr = wiimote.btaddr
         self.model = wiimote.model
         self.reporting_mode = self.MODE_DEFAULT
-        self._controlsocket = bluetooth.BluetoothSocket(bluetooth.L2CAP)
-        self._controlsocket.connect((self.btaddr, 17))
-        self._datasocket = bluetooth.BluetoothSocket(bluetooth.L2CAP)
-        self._datasocket.connect((self.btaddr, 19))
+        self.continuous = False
+        self.report_time = 0.0
+        self.report_length = 0
+        self._sensors = []
+        self._dispatch = {}
+        self.capture = None # see WiiMote.start_capture()
+        self.telemetry = None # see enable_telemetry()
+        # Packets are received into _buffer and their payload (without the
+        # 0xa1 header) is copied into _report, which is handed to the sensors.
+        # Both are allocated once, so receiving a report creates no objects.
+        # (Handlers index a bytearray instead of a memoryview because items of
+        # a memoryview are 1-char strings on Python 2, not ints.)
+        self._buffer = bytearray(self.REPORT_BUFFER_SIZE)
+        self._payload = memoryview(self._buffer)[1:]
+        self._report = bytearray(self.REPORT_BUFFER_SIZE - 1)
+        self._open()
+        self.set_report_mode(self.MODE_DEFAULT)
+
+    def _open(self):
+        self._connect()
         if self.model == 'Nintendo RVL-CNT-01':
             self._sendsocket = self._controlsocket
             self._CMD_SET_REPORT = 0x52
@@ -429,78 +2252,531 @@ class CommunicationHandler(threading.Thread):
         try:
             self._datasocket.settimeout(1)
         except NotImplementedError:
-            print "socket timeout not implemented with this bluetooth module"
-        self.set_report_mode(self.MODE_ACC_IR)
+            print("socket timeout not implemented with this bluetooth module")
+        self._recv_into = getattr(self._datasocket, 'recv_into', self._recv_copy)
+
+    def _connect(self):
+        # the PyBluez L2CAP transport; other transports override this
+        bluetooth = _bluetooth()
+        self._controlsocket = bluetooth.BluetoothSocket(bluetooth.L2CAP)
+        self._controlsocket.connect((self.btaddr, 17))
+        self._datasocket = bluetooth.BluetoothSocket(bluetooth.L2CAP)
+        self._datasocket.connect((self.btaddr, 19))
+
+    def on_receive_thread(self):
+        return threading.current_thread() is self
+
+    def _recv_copy(self, buf):
+        # fallback for socket implementations without recv_into()
+        data = self._datasocket.recv(len(buf))
+        buf[:len(data)] = data
+        return len(data)
     
     def _send(self, *bytes_to_send):
+        # report id and payload, given as single bytes or lists of bytes
         _debug("sending " + str(bytes_to_send))
-        data_str = chr(self._CMD_SET_REPORT)
-        bytes_to_send = _flatten(bytes_to_send)
-        bytes_to_send[1] |= int(self.rumble)
-        for b in bytes_to_send:
-            data_str += chr(b)
-        self._sendsocket.send(data_str)
+        data = bytearray([self._CMD_SET_REPORT])
+        for item in bytes_to_send:
+            if isinstance(item, int):
+                data.append(item)
+            else:
+                data.extend(item)
+        data[2] |= int(self.rumble) # rumble bit of every output report
+        self._sendsocket.send(bytes(data))
+
+    def batch(self):
+        """
+        Returns a context manager that holds back LED, rumble and report
+        mode changes made by the current thread until its outermost batch
+        is left and then sends them together, as few reports as possible.
+        Changes made by other threads are sent right away.
+        """
+        return _OutputBatch(self)
+
+    def _thread_batch(self):
+        # depth and held back changes of the batches open in this thread
+        batch = self._batches
+        if not hasattr(batch, 'depth'):
+            batch.depth = 0
+            batch.changes = {}
+        return batch
+
+    def _set_output(self, field, value):
+        batch = self._thread_batch()
+        if batch.depth:
+            batch.changes[field] = value
+        else:
+            self._flush_output({field: value})
+
+    def _flush_output(self, changes=None):
+        with self._output_lock:
+            if changes:
+                self._pending.update(changes)
+            if not self._link_down: # otherwise kept until it is back
+                self._send_pending()
+
+    def _send_pending(self):
+        # must be called with self._output_lock acquired
+        changed = dict((field, value) for field, value in self._pending.items()
+                       if self._sent.get(field) != value)
+        self._pending.clear()
+        if not changed:
+            return
+        reports = []
+        if 'leds' in changed:
+            reports.append((self.RPT_LED, changed['leds']))
+        if 'mode' in changed:
+            reports.append((self.RPT_MODE,) + changed['mode'])
+        if 'rumble' in changed:
+            self.rumble = changed['rumble']
+            if not reports: # otherwise the rumble bit rides along
+                reports.append((self.RPT_RUMBLE, 0x00))
+        for report in reports:
+            self._send(*report)
+        self._sent.update(changed)
+
+    def _resend_output(self):
+        # the Wiimote lost all output state (after a reconnect), send it again
+        with self._output_lock:
+            for field, value in self._sent.items():
+                self._pending.setdefault(field, value)
+            self._sent.clear()
+            self._flush_output()
+
+    def _forget_output(self, field=None):
+        # the Wiimote lost (some of) its state, the next changes are sent
+        # in any case
+        with self._output_lock:
+            if field is None:
+                self._sent.clear()
+            else:
+                self._sent.pop(field, None)
 
     def run(self):
         self.running = True
         while self.running:
             try:
-                data = map(ord,self._datasocket.recv(32))
-            except bluetooth.BluetoothError:
-                continue
-            if len(data) < 2: # disconnect!
-                self.running = False
-            else:
-                self._handle(data)
+                if not self._receive():
+                    self.running = self._reconnect()
+            except IOError as e: # incl. socket errors and BluetoothError
+                if _is_timeout(e):
+                    self._timed_out()
+                else:
+                    _debug("connection lost: %s" % e)
+                    self.running = self._reconnect()
         self._dispose()
 
+    def stop(self):
+        """ Ends the receive loop, also while waiting to reconnect. """
+        self.running = False
+        self._stopping.set()
+
+    def _reconnect(self):
+        """
+        Tries to reestablish a lost connection as configured with
+        WiiMote.enable_reconnect(), waiting twice as long after each failed
+        attempt. Returns True once it is back.
+        """
+        policy = self.wiimote._reconnect_policy
+        if policy is None or not self.running:
+            return False
+        delay, max_delay, max_attempts = policy
+        lost_at = _monotonic()
+        self._link_down = True
+        self._close_sockets()
+        attempts = 0
+        while max_attempts is None or attempts < max_attempts:
+            self._stopping.wait(delay)
+            if not self.running:
+                return False
+            attempts += 1
+            try:
+                self._open()
+            except IOError as e:
+                _debug("reconnect attempt %d failed: %s" % (attempts, e))
+                self._close_sockets()
+                delay = min(delay * 2, max_delay)
+                continue
+            self._link_down = False
+            restored_at = _monotonic()
+            if self.telemetry is not None:
+                self.telemetry.reconnects += 1
+                self.telemetry.durations['reconnect'] = restored_at - lost_at
+            self.wiimote._reconnected(lost_at, restored_at)
+            return True
+        return False
+
+    def _close_sockets(self):
+        for sock in [getattr(self, '_datasocket', None),
+                     getattr(self, '_controlsocket', None)]:
+            if sock is not None:
+                try:
+                    sock.close()
+                except IOError:
+                    pass
+
+    def _timed_out(self):
+        if self.telemetry is not None:
+            self.telemetry.timeouts += 1
+
+    def _receive(self):
+        """
+        Receives and handles a single report. Returns False if the
+        Wiimote has disconnected. Only receiving raises an IOError; errors
+        of the handlers and DIRECT callbacks (which may be IOErrors, too)
+        are printed, as they say nothing about the connection.
+        """
+        num_bytes = self._recv_into(self._buffer)
+        if num_bytes < 2: # disconnect!
+            return False
+        self.report_time = self._timestamp()
+        self.report_length = num_bytes - 1
+        self._report[:] = self._payload
+        try:
+            if self.capture is not None:
+                self.capture.write(self.report_time, self._buffer, num_bytes)
+            if self.telemetry is not None:
+                self.telemetry.report_received(self._buffer[1], self.report_time)
+                if self._buffer[1] not in self._dispatch:
+                    self.telemetry.unexpected += 1
+            self._handle(self._report)
+        except Exception:
+            traceback.print_exc()
+        return True
+
+    def _timestamp(self):
+        # receive time of the report in _buffer
+        return _monotonic()
+
     def _dispose(self):
         self._datasocket.close()
         self._controlsocket.close()
         self.running = False
+        self.wiimote.dispatcher.stop()
 
-    def set_report_mode(self, mode):
+    def set_report_mode(self, mode, continuous=False):
+        """
+        Without *continuous*, the Wiimote only sends a report when some
+        value has changed.
+        """
         self.reporting_mode = mode
-        self._send(0x12, 0x00, mode)
-
-    def _handle(self, bytes_read):
-        #_debug(bytes_read)
-        #assert(bytes_read[0] == self._CMD_SET_REPORT + 1)
-        rpt_type = bytes_read[1]
-        # all reports include button data
-        self.wiimote.buttons.handle_report(bytes_read[1:])
-        if rpt_type in Accelerometer.SUPPORTED_REPORTS:
-            self.wiimote.accelerometer.handle_report(bytes_read[1:])
-        if rpt_type in Memory.SUPPORTED_REPORTS:
-            self.wiimote.memory.handle_report(bytes_read[1:])
-        if rpt_type in IRCam.SUPPORTED_REPORTS:
-            self.wiimote.ir.handle_report(bytes_read[1:])
+        self.continuous = continuous
+        self._update_dispatch_table()
+        self._set_output('mode', (0x04 if continuous else 0x00, mode))
+
+    def register_sensor(self, sensor):
+        """
+        Routes all incoming reports listed in *sensor*.SUPPORTED_REPORTS
+        to *sensor*.handle_report().
+        """
+        if sensor not in self._sensors:
+            self._sensors.append(sensor)
+            self._instrument(sensor)
+            self._update_dispatch_table()
+
+    def unregister_sensor(self, sensor):
+        if sensor in self._sensors:
+            self._sensors.remove(sensor)
+            self._uninstrument(sensor)
+            self._update_dispatch_table()
+
+    def enable_telemetry(self):
+        """
+        Starts collecting a Telemetry: report counts and inter-arrival
+        times, and the time spent in each sensor's handler and callbacks.
+        """
+        if self.telemetry is None:
+            self.telemetry = Telemetry()
+            for sensor in self._sensors:
+                self._instrument(sensor)
+            self._update_dispatch_table()
+
+    def disable_telemetry(self):
+        """ Removes all instrumentation. """
+        if self.telemetry is not None:
+            self.telemetry = None
+            for sensor in self._sensors:
+                self._uninstrument(sensor)
+            self._update_dispatch_table()
+
+    def _instrument(self, sensor):
+        # shadows _notify_callbacks() with a timed version of itself
+        if self.telemetry is not None and hasattr(sensor, '_notify_callbacks'):
+            self._uninstrument(sensor)
+            sensor._notify_callbacks = self.telemetry.timer(
+                type(sensor).__name__ + '.callbacks', sensor._notify_callbacks)
+
+    def _uninstrument(self, sensor):
+        if isinstance(sensor.__dict__.get('_notify_callbacks'), _Timer):
+            del sensor._notify_callbacks
+
+    def _handler(self, sensor):
+        if self.telemetry is None:
+            return sensor.handle_report
+        return self.telemetry.timer(type(sensor).__name__ + '.handle_report',
+                                    sensor.handle_report)
+
+    def _update_dispatch_table(self):
+        # Maps each report id that may arrive in the current reporting mode
+        # to the handlers interested in it, so that _handle() does not need
+        # to check every sensor for every report. Only called when the mode
+        # or the set of sensors changes.
+        expected = self._expected_reports()
+        dispatch = {}
+        for rpt_type in range(0x20, 0x40):
+            if rpt_type in expected:
+                dispatch[rpt_type] = tuple(self._handler(sensor)
+                                           for sensor in self._sensors
+                                           if rpt_type in sensor.SUPPORTED_REPORTS)
+        # replaced as a whole, the receive thread never sees a partial table
+        self._dispatch = dispatch
+
+    def _expected_reports(self):
+        return self.RPT_ALWAYS_EXPECTED + \
+            self.RPT_MODE_PAIRS.get(self.reporting_mode, [self.reporting_mode])
+
+    def _handle(self, report):
+        #_debug(report)
+        for handle_report in self._dispatch.get(report[0], ()):
+            handle_report(report)
 
     def set_rumble(self, state):
-        self.rumble = state
-        # send any report to toggle rumble bit
-        self._send(self.RPT_STATUS_REQ, int(state))
+        self._set_output('rumble', bool(state))
+
+    def set_leds(self, led_byte):
+        self._set_output('leds', led_byte)
+
+    def request_status(self):
+        # answered with a status report (0x20)
+        self._send(self.RPT_STATUS_REQ, 0x00)
+
+
+class _OutputBatch(object):
+    # see CommunicationHandler.batch()
+
+    def __init__(self, com):
+        self._com = com
+
+    def __enter__(self):
+        self._com._thread_batch().depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        batch = self._com._thread_batch()
+        batch.depth -= 1
+        if batch.depth == 0:
+            changes, batch.changes = batch.changes, {}
+            self._com._flush_output(changes)
+        return False
 
 
 class WiiMote(object):
 
+    # subclasses may use a handler that does not talk to a Bluetooth socket
+    _com_class = CommunicationHandler
+    # whether the device and its calibration are recorded in DEVICE_REGISTRY
+    # and CALIBRATION_CACHE; only for Wiimotes connected through L2CAP
+    _persistent = True
+
     # instance methods
     def __init__(self, btaddr, model):
         self.btaddr = btaddr
         self.model = model
         self.connected = False
-        self._com = CommunicationHandler(self)
+        self._started = False
+        self._reconnect_policy = None # see enable_reconnect()
+        self._gap_callbacks = []
+        self.gaps = [] # (lost_at, restored_at) of lost connections
+        self.dispatcher = CallbackDispatcher()
+        self._com = self._com_class(self)
         self._leds = LEDs(self)
         self.accelerometer = Accelerometer(self)
         self.buttons = Buttons(self)
         self.rumbler = Rumbler(self)
         self.memory = Memory(self)
         self.ir = IRCam(self)
+        self.nunchuk = Nunchuk(self)
+        self.motionplus = MotionPlus(self)
+        self.extension = Extension(self)
+        # the extension after the accelerometer, see MotionPlus
+        for sensor in [self.buttons, self.accelerometer, self.memory, self.ir,
+                       self.extension]:
+            self._com.register_sensor(sensor)
+        if STATS:
+            self.enable_stats()
+        self._start()
+
+    def _start(self):
         self._com.start()
+        self._started = True
+        # needs the receive thread for the acknowledgements
+        self._update_report_mode()
+        self.accelerometer.load_calibration()
         self.leds[0] = True
-       
+        self._com.request_status() # finds an extension plugged in already
+
+    def _status_received(self, plugged_in):
+        # called on the receive thread, which can not access the memory
+        thread = threading.Thread(target=self._handle_status, args=(plugged_in,))
+        thread.daemon = True
+        thread.start()
+
+    def _handle_status(self, plugged_in):
+        if plugged_in:
+            self.extension.initialize()
+        self._update_report_mode(force=True)
+
+    def _update_report_mode(self, force=False):
+        """
+        Switches to the smallest reporting mode that has the data of all
+        active sensors and powers the IR camera up or down as needed.
+        Called whenever a subscription changes; *force* sends the mode
+        even if it has not changed. Returns the result of the camera
+        initialization (an awaitable with wiimote_async), if any.
+        """
+        if not self._started:
+            return None
+        with_acc = self.accelerometer.active
+        if self.ir.active:
+            self.ir._update_camera_mode(self.extension.active)
+            mode = self.ir.report_mode(with_acc)
+        elif self.extension.active:
+            mode = self.extension.report_mode(with_acc)
+        else:
+            mode = self._com.MODE_ACC if with_acc else self._com.MODE_DEFAULT
+        # hold timers, heartbeats and resamplers need reports while
+        # nothing changes
+        continuous = bool(self.buttons._hold_callbacks) or any(
+            sensor._needs_continuous() for sensor in
+            [self.accelerometer, self.ir, self.nunchuk, self.motionplus])
+        if force:
+            self._com._forget_output('mode')
+        if force or (mode, continuous) != (self._com.reporting_mode,
+                                           self._com.continuous):
+            self._com.set_report_mode(mode, continuous)
+        if self.ir.active and not self.ir._powered:
+            if self._com.on_receive_thread():
+                return self._power_up_in_background()
+            return self.ir._power_up()
+        elif not self.ir.active and self.ir._powered:
+            self.ir._power_down()
+        return None
+
+    def _power_up_in_background(self):
+        # e.g. from a callback: the initialization waits for replies that
+        # arrive on the receive thread, so it runs on another one
+        self.ir._powered = True
+        thread = threading.Thread(target=self.ir._power_up)
+        thread.daemon = True
+        thread.start()
+        return None
+
     def disconnect(self):
-        self._com.running = False
+        self._com.stop()
+
+    def enable_reconnect(self, enabled=True, initial_delay=0.5, max_delay=30.0,
+                         max_attempts=None):
+        """
+        Makes the driver reconnect when the connection is lost, waiting
+        *initial_delay* seconds before the first attempt and twice as long
+        after each failed one, up to *max_delay*. Afterwards the reporting
+        mode, IR camera, LEDs, rumble, calibration and extension are
+        restored and callbacks continue. The time without data is recorded
+        in *gaps*, in each sensor's history (see SensorHistory.mark_gap())
+        and passed to gap callbacks. Only for Wiimotes with a receive
+        thread of their own, not for ManagedWiiMote or wiimote_async.
+        """
+        if enabled:
+            self._reconnect_policy = (initial_delay, max_delay, max_attempts)
+        else:
+            self._reconnect_policy = None
+
+    def register_gap_callback(self, func):
+        """
+        Calls func(lost_at, restored_at) with the monotonic times of a lost
+        connection once it has been restored, see enable_reconnect().
+        """
+        self._gap_callbacks.append(func)
+
+    def unregister_gap_callback(self, func):
+        if func in self._gap_callbacks:
+            self._gap_callbacks.remove(func)
+
+    def _reconnected(self, lost_at, restored_at):
+        # called on the receive thread, so the gap is marked before the
+        # first new sample arrives; restoring needs memory access, though
+        self.gaps.append((lost_at, restored_at))
+        for sensor in [self.accelerometer, self.ir, self.nunchuk,
+                       self.motionplus]:
+            sensor.history.mark_gap(lost_at, restored_at)
+        thread = threading.Thread(target=self._restore_state,
+                                  args=(lost_at, restored_at))
+        thread.daemon = True
+        thread.start()
+
+    def _restore_state(self, lost_at, restored_at):
+        self.ir._powered = False
+        self.extension._reset()
+        self._com._resend_output() # report mode, LEDs and rumble
+        self._update_report_mode() # IR camera
+        self.accelerometer.load_calibration()
+        self._com.request_status() # extension
+        for func in self._gap_callbacks:
+            func(lost_at, restored_at)
+
+    def enable_stats(self, enabled=True):
+        """
+        Switches the collection of stats() on or off. While it is off, the
+        driver is not instrumented at all.
+        """
+        if enabled:
+            self._com.enable_telemetry()
+        else:
+            self._com.disable_telemetry()
+
+    def stats(self):
+        """
+        Returns a dict of the driver's telemetry, or None if it is switched
+        off (see enable_stats()):
+        'reports': count, rate (reports/s) and percentiles of inter-arrival
+        time and jitter (deviation from the median interval) per report id,
+        'timers': time spent in each sensor's handle_report() and callbacks,
+        'timeouts', 'reconnects', 'retries' of IR initialization steps,
+        'unexpected' reports, 'durations' of single operations (e.g.
+        'ir_init') and 'dispatcher' queue depth and drops.
+        """
+        telemetry = self._com.telemetry
+        if telemetry is None:
+            return None
+        stats = telemetry.stats()
+        stats['dispatcher'] = {'queue_depth': self.dispatcher.queue_depth,
+                               'dropped': self.dispatcher.dropped}
+        return stats
+
+    def log_stats(self, path, interval=10.0):
+        """
+        Appends stats() to the CSV file at *path* every *interval* seconds
+        and returns the StatsLogger; call its stop() to end logging.
+        """
+        self.enable_stats()
+        logger = StatsLogger(self, path, interval)
+        logger.start()
+        return logger
+
+    def start_capture(self, path):
+        """
+        Appends every report received from now on to the capture file at
+        *path*, see wiimote_capture.
+        """
+        import wiimote_capture
+        self.stop_capture()
+        self._com.capture = wiimote_capture.CaptureWriter(path, self.btaddr,
+                                                          self.model)
+
+    def stop_capture(self):
+        capture, self._com.capture = self._com.capture, None
+        if capture is not None:
+            capture.close()
 
     def _get_capabilities(self):
         return None
@@ -517,6 +2793,16 @@ class WiiMote(object):
     def rumble(self, length=0.5):
         self.rumbler.rumble(length)
 
+    def batch(self):
+        """
+        Groups output changes into as few reports as possible:
+
+            with wm.batch():
+                wm.leds = [True, False, False, True]
+                wm.rumbler.set_rumble(True)
+        """
+        return self._com.batch()
+
     def get_leds(self):
         return self._leds
 
@@ -532,3 +2818,140 @@ class WiiMote(object):
     #rumble = property(get_rumble, set_rumble)
 
 
+class ManagedCommunicationHandler(CommunicationHandler):
+    """
+    Receives reports on the thread of a WiimoteManager instead of running
+    a thread of its own.
+    """
+
+    def start(self):
+        self.running = True
+        self.wiimote._manager._add_handler(self)
+
+    def on_receive_thread(self):
+        return threading.current_thread() is self.wiimote._manager
+
+    def _dispose(self):
+        self.running = False
+        self.wiimote._manager._remove_handler(self)
+
+
+class ManagedWiiMote(WiiMote):
+
+    _com_class = ManagedCommunicationHandler
+
+    def __init__(self, btaddr, model, manager):
+        self._manager = manager
+        WiiMote.__init__(self, btaddr, model)
+        self.player = None
+
+    def disconnect(self):
+        self._com._dispose()
+
+
+class WiimoteManager(threading.Thread):
+    """
+    Connects any number of Wiimotes and receives the reports of all of them
+    in a single thread, which waits on all data sockets at once with
+    select.poll(). Sensor callbacks of all managed Wiimotes run on this
+    thread.
+
+    manager = WiimoteManager()
+    wm1 = manager.connect(btaddr1)
+    wm2 = manager.connect(btaddr2)
+
+    Each Wiimote gets a player number (1, 2, ...) in the order of
+    connection, which is shown on its LEDs.
+    """
+
+    _wiimote_class = ManagedWiiMote
+
+    def __init__(self):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.wiimotes = []
+        self._handlers = {} # data socket fd -> CommunicationHandler
+        self._poll = select.poll()
+        # calls to run on the manager's thread; the pipe wakes it up
+        self._calls = collections.deque()
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        self._poll.register(self._wakeup_r, select.POLLIN)
+        self.running = True
+        self.start()
+
+    def connect(self, btaddr, model=None):
+        """
+        Establishes a connection to the Wiimote at *btaddr* and returns a
+        Wiimote object whose reports are received by this manager.
+        """
+        model = _check_model(btaddr, model)
+        wm = self._wiimote_class(btaddr, model, self)
+        if wm._persistent:
+            _remember_device(btaddr, model)
+        self.wiimotes.append(wm)
+        self._assign_players()
+        return wm
+
+    def disconnect_all(self):
+        for wm in self.wiimotes[:]:
+            wm.disconnect()
+
+    def stop(self):
+        self.disconnect_all()
+        self.running = False
+        self._call_soon(lambda: None)
+
+    def _assign_players(self):
+        for player, wm in enumerate(self.wiimotes, 1):
+            if wm.player != player:
+                wm.player = player
+                if player <= 4:
+                    wm.leds = [led == player - 1 for led in range(4)]
+                else: # binary beyond four players
+                    wm.leds = [bool(player & (1 << led)) for led in range(4)]
+
+    def _add_handler(self, com):
+        fd = com._datasocket.fileno()
+
+        def add():
+            self._handlers[fd] = com
+            self._poll.register(fd, select.POLLIN)
+        self._call_soon(add)
+
+    def _remove_handler(self, com):
+        fd = com._datasocket.fileno()
+        if com.wiimote in self.wiimotes:
+            self.wiimotes.remove(com.wiimote)
+            self._assign_players()
+
+        def remove():
+            if self._handlers.pop(fd, None) is not None:
+                self._poll.unregister(fd)
+                CommunicationHandler._dispose(com)
+        self._call_soon(remove)
+
+    def _call_soon(self, func):
+        self._calls.append(func)
+        os.write(self._wakeup_w, b'x')
+
+    def run(self):
+        while self.running:
+            for fd, event in self._poll.poll():
+                if fd == self._wakeup_r:
+                    os.read(self._wakeup_r, 512)
+                    while self._calls:
+                        self._calls.popleft()()
+                    continue
+                com = self._handlers.get(fd)
+                if com is None:
+                    continue
+                try:
+                    alive = com._receive()
+                except IOError as e:
+                    if _is_timeout(e):
+                        com._timed_out()
+                        continue
+                    _debug("connection lost: %s" % e)
+                    alive = False
+                if not alive:
+                    com._dispose()
@@ -0,0 +1,380 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# asyncio interface for the wiimote module (Python 3.6+ only).
+#
+# Wiimotes connected through this module do not get a receive thread of
+# their own. Their data sockets are watched by the event loop instead, so
+# one loop can serve several controllers, and all sensor callbacks run on
+# the loop's thread.
+#
+#   wm = await wiimote.connect_async("B8:AE:6E:1B:A3:9B")
+#   calibration = await wm.memory.read(0x16, 10, eeprom=True)
+#   async for report in wm.reports():
+#       print(report.time, hex(report.id))
+#       if report.id == 0x20:
+#           break # closes the stream
+
+import asyncio
+import collections
+import threading
+
+import wiimote
+
+# a raw input report: receive time, report id and the report bytes
+Report = collections.namedtuple('Report', ['time', 'id', 'data'])
+
+
+async def connect(btaddr, model=None):
+    """
+    Establishes a connection to the Wiimote at *btaddr* and returns an
+    AsyncWiiMote. Blocking Bluetooth calls run in the loop's executor.
+    """
+    loop = asyncio.get_event_loop()
+    if model is None:
+        model = wiimote._registered_model(btaddr)
+    if model is None:
+        model = await loop.run_in_executor(None, wiimote._bluetooth().lookup_name,
+                                           btaddr)
+    if model not in wiimote.KNOWN_DEVICES:
+        raise Exception("Wiimote model '%s' unknown!" % (model))
+    wm = await loop.run_in_executor(None, AsyncWiiMote, btaddr, model, loop)
+    await wm._start_async()
+    if wm._persistent:
+        wiimote._remember_device(btaddr, model)
+    return wm
+
+
+class ReportStream(object):
+    """
+    The raw reports of a Wiimote, for async for. At most *maxsize* reports
+    are buffered; if a slow consumer lets the buffer fill up, the oldest
+    report is dropped and counted in *dropped*. The Wiimote is read without
+    waiting for its streams, so sensor callbacks and memory replies are
+    never held up by one.
+
+    A stream is closed when its async for loop ends, also by break or an
+    exception, or when it is left as an async context manager:
+
+        async with wm.reports() as reports:
+            report = await reports.get()
+    """
+
+    def __init__(self, com, maxsize):
+        self._com = com
+        self._queue = asyncio.Queue(maxsize)
+        self._closed = False
+        self.dropped = 0
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        try:
+            while True:
+                report = await self.get()
+                if report is None:
+                    return
+                yield report
+        finally:
+            self.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, tb):
+        self.close()
+        return False
+
+    async def get(self):
+        """
+        Returns the next report, or None once the stream is closed and its
+        buffered reports are consumed.
+        """
+        if self._closed and self._queue.empty():
+            return None
+        return await self._queue.get()
+
+    def close(self):
+        """ Ends the iteration once the buffered reports are consumed. """
+        if self._closed:
+            return
+        self._closed = True
+        self._com._remove_stream(self)
+        if self._queue.empty():
+            self._queue.put_nowait(None) # wake up a waiting consumer
+
+    def _put(self, report):
+        if self._queue.full():
+            self._queue.get_nowait()
+            self.dropped += 1
+        self._queue.put_nowait(report)
+
+
+class AsyncCommunicationHandler(wiimote.CommunicationHandler):
+    """
+    Receives reports in the event loop's thread via add_reader() instead of
+    running a thread of its own.
+    """
+
+    _loop_thread = None
+
+    def start(self):
+        # called on the loop's thread
+        self._loop = self.wiimote._loop
+        self._loop_thread = threading.current_thread()
+        self._streams = []
+        self.running = True
+        self._loop.add_reader(self._datasocket.fileno(), self._on_readable)
+        self._reading = True
+
+    def on_receive_thread(self):
+        # nothing can be received while the loop's thread waits
+        return threading.current_thread() is self._loop_thread
+
+    def _on_readable(self):
+        try:
+            self.running = self._receive()
+        except IOError as e:
+            if wiimote._is_timeout(e):
+                return
+            self.running = False
+        if not self.running:
+            self._dispose()
+
+    def _handle(self, report):
+        wiimote.CommunicationHandler._handle(self, report)
+        if self._streams:
+            rpt = Report(self.report_time, report[0],
+                         bytes(report[:self.report_length]))
+            for stream in self._streams:
+                stream._put(rpt)
+
+    def _stop_reading(self):
+        if self._reading:
+            self._loop.remove_reader(self._datasocket.fileno())
+            self._reading = False
+
+    def open_stream(self, maxsize):
+        stream = ReportStream(self, maxsize)
+        self._streams.append(stream)
+        return stream
+
+    def _remove_stream(self, stream):
+        if stream in self._streams:
+            self._streams.remove(stream)
+
+    def _dispose(self):
+        self._stop_reading()
+        self.running = False
+        for stream in self._streams[:]:
+            stream.close()
+        wiimote.CommunicationHandler._dispose(self)
+
+
+class AsyncMemory(wiimote.Memory):
+    """
+    Memory with coroutine versions of read(), write(), write_blocks() and
+    send_acknowledged().
+    """
+
+    def _bind(self):
+        # asyncio primitives have to be created on the loop's thread
+        self._transaction_lock = asyncio.Lock()
+        self._changed = asyncio.Event()
+
+    async def write(self, address, data, eeprom=False, timeout=None):
+        await self.write_blocks([(address, data)], eeprom, timeout)
+
+    async def write_blocks(self, blocks, eeprom=False, timeout=None):
+        chunks = self._split_blocks(blocks)
+        timeout = self.timeout if timeout is None else timeout
+        async with self._transaction_lock:
+            self._error = None
+            self._pending_writes = 0
+            for address, bytes_to_send in chunks:
+                await self._wait_for(lambda: self._pending_writes < self.max_pending_writes,
+                                     timeout, "Memory write at 0x%06x" % address)
+                self._pending_writes += 1
+                self._send_write(address, bytes_to_send, eeprom)
+            await self._wait_for(lambda: self._pending_writes == 0, timeout,
+                                 "Memory write")
+
+    async def send_acknowledged(self, rpt, data, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        async with self._transaction_lock:
+            self._error = None
+            self._awaited_ack = rpt
+            self._send_acknowledged(rpt, data)
+            try:
+                await self._wait_for(lambda: self._awaited_ack is None, timeout,
+                                     "Acknowledgement of report 0x%02x" % rpt)
+            finally:
+                self._awaited_ack = None
+
+    async def read(self, address, amount, eeprom=False, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        async with self._transaction_lock:
+            self._start_read(amount)
+            self._send_read(address, amount, eeprom)
+            try:
+                await self._wait_for(lambda: not self._request_in_progress,
+                                     timeout, "Memory read at 0x%06x" % address)
+            finally:
+                self._request_in_progress = False
+            return list(self._reply_buffer)
+
+    async def _wait_for(self, predicate, timeout, what):
+        loop = self.wiimote._loop
+        deadline = loop.time() + timeout
+        while not predicate() and self._error is None:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                raise RuntimeError("%s timed out after %.2f s." % (what, timeout))
+            self._changed.clear()
+            try:
+                await asyncio.wait_for(self._changed.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+        if self._error is not None:
+            raise RuntimeError(self._error)
+
+    def handle_report(self, report):
+        # runs on the loop's thread, no locking needed
+        self._update(report)
+        self._changed.set()
+
+
+class AsyncIRCam(wiimote.IRCam):
+    """
+    IRCam whose initialization is a coroutine, see IRCam._initialize().
+    """
+
+    async def _initialize(self):
+        started = wiimote._monotonic()
+        for func, args in self._init_steps():
+            for attempt in range(self.INIT_RETRIES + 1):
+                try:
+                    await func(*args, timeout=self.INIT_TIMEOUT)
+                    break
+                except RuntimeError as e:
+                    self._step_failed(e, attempt)
+            else:
+                self._powered = False
+                return False
+        self._initialized(started)
+        return True
+
+
+class AsyncMotionPlus(wiimote.MotionPlus):
+    """
+    MotionPlus whose activate() and deactivate() are coroutines.
+    """
+
+    async def activate(self):
+        memory = self._wiimote.memory
+        try:
+            identifier = await memory.read(self.PROBE_ADDRESS,
+                                           wiimote.Extension.ID_SIZE)
+        except RuntimeError:
+            return False
+        if not self._probe_found(identifier):
+            return False
+        self._wiimote.extension._motionplus_activated = True
+        await memory.write_blocks(self.ACTIVATE_BLOCKS)
+        return True
+
+    async def deactivate(self):
+        self._wiimote.extension._motionplus_activated = False
+        await self._wiimote.memory.write_blocks(self.DEACTIVATE_BLOCKS)
+
+
+class AsyncWiiMote(wiimote.WiiMote):
+    """
+    WiiMote served by an asyncio event loop. Use connect() to create one.
+    memory.read()/write() return awaitables, as do motionplus.activate() and
+    deactivate(), ir.set_mode_sensitivity() and registering the first IR
+    callback while the camera is initialized.
+    Reading a sensor's state switches it on without waiting for its first
+    data, which can only arrive once the loop runs again.
+    """
+
+    _com_class = AsyncCommunicationHandler
+
+    def __init__(self, btaddr, model, loop):
+        self._loop = loop
+        wiimote.WiiMote.__init__(self, btaddr, model)
+        self._com.unregister_sensor(self.memory)
+        self.memory = AsyncMemory(self)
+        self._com.register_sensor(self.memory)
+        self._com.unregister_sensor(self.ir)
+        self.ir = AsyncIRCam(self)
+        self._com.register_sensor(self.ir)
+        self.motionplus = AsyncMotionPlus(self)
+
+    def _start(self):
+        pass # see _start_async(), which has to run on the loop
+
+    async def _start_async(self):
+        self.memory._bind()
+        self._com.start()
+        self._started = True
+        camera_ready = self._update_report_mode()
+        if camera_ready is not None:
+            await camera_ready
+        await self._load_calibration()
+        self.leds[0] = True
+        self._com.request_status()
+
+    def _update_report_mode(self, force=False):
+        result = wiimote.WiiMote._update_report_mode(self, force)
+        if result is not None:
+            # initializes the IR camera in the background
+            return self._loop.create_task(result)
+        return None
+
+    def _power_up_in_background(self):
+        # the initialization is a coroutine, see _update_report_mode()
+        return self.ir._power_up()
+
+    def _status_received(self, plugged_in):
+        self._loop.create_task(self._handle_status_async(plugged_in))
+
+    async def _handle_status_async(self, plugged_in):
+        if plugged_in:
+            await self._initialize_extension()
+        camera_ready = self._update_report_mode(force=True)
+        if camera_ready is not None:
+            await camera_ready
+
+    async def _initialize_extension(self):
+        ext = self.extension
+        try:
+            if not ext._motionplus_activated:
+                await self.memory.write_blocks(ext.INIT_BLOCKS)
+            identifier = await self.memory.read(ext.ID_ADDRESS, ext.ID_SIZE)
+        except RuntimeError:
+            identifier = None
+        ext._identify(identifier)
+
+    async def _load_calibration(self):
+        acc = self.accelerometer
+        if acc._load_cached_calibration():
+            return
+        try:
+            data = await self.memory.read(acc.CALIBRATION_ADDRESS,
+                                          acc.CALIBRATION_SIZE, eeprom=True)
+        except RuntimeError:
+            return
+        acc.set_calibration_data(data)
+
+    def reports(self, maxsize=64):
+        """
+        Returns a ReportStream of all reports received from now on:
+        async for report in wm.reports(): ...
+        Up to *maxsize* reports are buffered, older ones are dropped.
+        """
+        return self._com.open_stream(maxsize)
+
+    def disconnect(self):
+        self._com._dispose()
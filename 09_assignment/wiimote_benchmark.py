@@ -0,0 +1,368 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Microbenchmarks for the wiimote driver.
+#
+# No Wiimote is needed: reports are pushed through a local socketpair into a
+# real CommunicationHandler thread. For comparison, the same reports are also
+# received the way the driver did it before (new objects for every report)
+# and through the recv() fallback for sockets without recv_into().
+# A second benchmark compares the CPU time per controller of one receive
+# thread per Wiimote against a WiimoteManager serving all of them, and a
+# third one runs emulated Wiimotes (see wiimote_emulator) through the
+# complete connect and command path at high report rates.
+#
+# usage: python wiimote_benchmark.py [num_reports]
+
+import os
+import socket
+import sys
+import threading
+import time
+
+import wiimote
+import wiimote_emulator
+
+try:
+    import tracemalloc
+except ImportError: # Python 2
+    tracemalloc = None
+
+# 0x33 report (buttons, accelerometer, 4 extended IR objects) incl. 0xa1 header
+SAMPLE_REPORT = bytearray([0xa1, 0x33, 0x60, 0x08, 0x80, 0x81, 0x9a] +
+                          [0x40, 0x50, 0x13] * 2 + [0xff, 0xff, 0xff] * 2)
+
+if str is bytes: # Python 2, recv() returns a str
+    def _byte_values(data):
+        return map(ord, data)
+else:
+    _byte_values = list
+
+
+class LoopbackMixin(object):
+    """
+    Makes a CommunicationHandler read from one end of a socketpair instead
+    of a Bluetooth L2CAP channel. The other end is available as *feeder*.
+    """
+
+    def _connect(self):
+        self._datasocket, self.feeder = socket.socketpair(socket.AF_UNIX,
+                                                          socket.SOCK_SEQPACKET)
+        self._controlsocket = self._datasocket
+
+    def _send(self, *bytes_to_send):
+        super(LoopbackMixin, self)._send(*bytes_to_send)
+        rpt = bytes_to_send[0]
+        if rpt == wiimote.Memory.RPT_WRITE or \
+           wiimote._to_byte_list(bytes_to_send[1])[0] & wiimote.Memory.ACK_REQUEST:
+            # acknowledge memory writes and requests like a Wiimote does
+            self.feeder.send(bytes(bytearray([0xa1, 0x22, 0x00, 0x00, rpt, 0x00])))
+        elif bytes_to_send[0] == wiimote.Memory.RPT_READ:
+            # empty memory, 16 bytes per reply
+            amount = (bytes_to_send[3][0] << 8) | bytes_to_send[3][1]
+            for offset in range(0, amount, 16):
+                size = min(amount - offset, 16)
+                self.feeder.send(bytes(bytearray([0xa1, 0x21, 0x00, 0x00,
+                                                  (size - 1) << 4, 0x00, 0x00] +
+                                                 [0x00] * 16)))
+
+
+class LoopbackHandler(LoopbackMixin, wiimote.CommunicationHandler):
+    pass
+
+
+class ManagedLoopbackHandler(LoopbackMixin, wiimote.ManagedCommunicationHandler):
+    pass
+
+
+class LegacyLoopbackHandler(LoopbackHandler):
+    """
+    Receive loop as it was before recv_into(): every report becomes a new
+    list of ints (map(ord, recv()) on Python 2), see _legacy_handle().
+    """
+
+    def run(self):
+        self.running = True
+        while self.running:
+            try:
+                data = _byte_values(self._datasocket.recv(32))
+            except socket.timeout:
+                continue
+            if len(data) < 2: # disconnect!
+                self.running = False
+            else:
+                _legacy_handle(self, data)
+        self._dispose()
+
+
+def _legacy_handle(com, data):
+    # Like the old CommunicationHandler._handle(): every sensor is checked
+    # and each interested one gets a slice of its own. The slices become
+    # bytearrays, as today's handlers decode from buffers.
+    rpt_type = data[1]
+    for sensor in com._sensors:
+        if rpt_type in sensor.SUPPORTED_REPORTS:
+            sensor.handle_report(bytearray(data[1:]))
+
+
+class FallbackLoopbackHandler(LoopbackHandler):
+    """ The current receive loop on a socket without recv_into(). """
+
+    def _open(self):
+        super(FallbackLoopbackHandler, self)._open()
+        self._recv_into = self._recv_copy
+
+
+class LoopbackWiiMote(wiimote.WiiMote):
+
+    _com_class = LoopbackHandler
+    _persistent = False
+
+    def __init__(self):
+        wiimote.WiiMote.__init__(self, "00:00:00:00:00:00",
+                                 wiimote.KNOWN_DEVICES[1])
+        self.ir.enable() # SAMPLE_REPORT has IR data
+
+
+class LegacyLoopbackWiiMote(LoopbackWiiMote):
+
+    _com_class = LegacyLoopbackHandler
+
+
+class FallbackLoopbackWiiMote(LoopbackWiiMote):
+
+    _com_class = FallbackLoopbackHandler
+
+
+class InstrumentedLoopbackWiiMote(LoopbackWiiMote):
+
+    def __init__(self):
+        LoopbackWiiMote.__init__(self)
+        self.enable_stats()
+
+
+class ManagedLoopbackWiiMote(wiimote.ManagedWiiMote):
+
+    _com_class = ManagedLoopbackHandler
+    _persistent = False
+
+    def __init__(self, btaddr, model, manager):
+        wiimote.ManagedWiiMote.__init__(self, btaddr, model, manager)
+        self.ir.enable()
+
+
+class LoopbackManager(wiimote.WiimoteManager):
+
+    _wiimote_class = ManagedLoopbackWiiMote
+
+
+def _drain(sock):
+    # the driver sends its commands into the feeder end; throw them away
+    sock.setblocking(False)
+    try:
+        while sock.recv(64):
+            pass
+    except socket.error:
+        pass
+    sock.setblocking(True)
+
+
+def bench_throughput(wiimote_class, num_reports):
+    """
+    Pushes *num_reports* reports into the receive thread as fast as possible
+    and returns the rate (reports/s) at which the thread consumed them.
+    """
+    wm = wiimote_class()
+    feeder = wm._com.feeder
+    _drain(feeder)
+    done = threading.Event()
+    count = [0]
+
+    def on_acc(state):
+        count[0] += 1
+        if count[0] == num_reports:
+            done.set()
+    wm.accelerometer.register_callback(on_acc)
+    report = bytes(SAMPLE_REPORT)
+    start = time.time()
+    for i in range(num_reports):
+        feeder.send(report)
+    done.wait()
+    elapsed = time.time() - start
+    wm.disconnect()
+    feeder.close()
+    wm._com.join()
+    return num_reports / elapsed
+
+
+def bench_allocations(num_reports, decode=True):
+    """
+    Returns the peak memory allocated while receiving a report from a
+    socket and, with *decode*, handling it, in bytes per report, as
+    (legacy, recv() fallback, recv_into()). Returns None if tracemalloc
+    is not available (Python < 3.9).
+    """
+    if not hasattr(tracemalloc, 'reset_peak'):
+        return None
+    wm = LoopbackWiiMote()
+    _drain(wm._com.feeder)
+    wm._com.feeder.close()
+    wm._com.join()
+    com = wm._com
+    # the receive thread has stopped, receive here from a new socketpair
+    com._datasocket, feeder = socket.socketpair(socket.AF_UNIX,
+                                                socket.SOCK_SEQPACKET)
+    if not decode:
+        for sensor in com._sensors:
+            sensor.handle_report = lambda report: None
+        com._update_dispatch_table()
+    report = bytes(SAMPLE_REPORT)
+
+    def legacy():
+        _legacy_handle(com, _byte_values(com._datasocket.recv(32)))
+    results = []
+    for receive, recv_into in [(legacy, None),
+                               (com._receive, com._recv_copy),
+                               (com._receive, com._datasocket.recv_into)]:
+        com._recv_into = recv_into
+        feeder.send(report)
+        receive() # warm up
+        tracemalloc.start()
+        allocated = 0
+        for i in range(num_reports):
+            feeder.send(report)
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            receive()
+            allocated += tracemalloc.get_traced_memory()[1] - before
+        tracemalloc.stop()
+        results.append(allocated / float(num_reports))
+    feeder.close()
+    com._datasocket.close()
+    return results
+
+
+def _cpu_time():
+    times = os.times()
+    return times[0] + times[1]
+
+
+def bench_cpu_per_controller(num_controllers, managed, rate=100, duration=2.0):
+    """
+    Feeds *num_controllers* Wiimotes with *rate* reports/s each and returns
+    the process CPU time spent per controller, in percent of one core. With
+    *managed*, all Wiimotes share one WiimoteManager, otherwise each one has
+    its own receive thread.
+    """
+    if managed:
+        manager = LoopbackManager()
+        wiimotes = [manager.connect("00:00:00:00:00:%02x" % i,
+                                    wiimote.KNOWN_DEVICES[1])
+                    for i in range(num_controllers)]
+    else:
+        wiimotes = [LoopbackWiiMote() for i in range(num_controllers)]
+    feeders = [wm._com.feeder for wm in wiimotes]
+    for feeder in feeders:
+        _drain(feeder)
+    report = bytes(SAMPLE_REPORT)
+    interval = 1.0 / rate
+    num_ticks = int(duration * rate)
+    start_cpu = _cpu_time()
+    next_tick = time.time()
+    for i in range(num_ticks):
+        for feeder in feeders:
+            feeder.send(report)
+        next_tick += interval
+        delay = next_tick - time.time()
+        if delay > 0:
+            time.sleep(delay)
+    cpu = _cpu_time() - start_cpu
+    for wm, feeder in zip(wiimotes, feeders):
+        wm.disconnect()
+        _drain(feeder)
+        feeder.close()
+    if managed:
+        manager.stop()
+        manager.join()
+    else:
+        for wm in wiimotes:
+            wm._com.join()
+    return 100.0 * cpu / duration / num_controllers
+
+
+def bench_emulated(num_devices, rate=1000, duration=2.0, managed=False):
+    """
+    Connects to *num_devices* emulated Wiimotes sending *rate* reports/s
+    each (accelerometer and IR) and returns the percentage of the sent
+    reports that reached a callback and the process CPU time in percent of
+    one core.
+    """
+    emulation = wiimote_emulator.Emulation()
+    if managed:
+        manager = emulation.manager()
+        wiimotes = [manager.connect(emulation.add_device(rate=rate).btaddr)
+                    for i in range(num_devices)]
+    else:
+        wiimotes = [emulation.connect(rate=rate) for i in range(num_devices)]
+    count = [0]
+
+    def on_acc(state):
+        count[0] += 1
+    for wm in wiimotes:
+        wm.ir.enable()
+        wm.accelerometer.register_callback(on_acc)
+    time.sleep(0.2) # IR camera initialization
+    devices = [wm.device for wm in wiimotes]
+    sent_before = sum(device.sent for device in devices)
+    count[0] = 0
+    start_cpu = _cpu_time()
+    time.sleep(duration)
+    cpu = _cpu_time() - start_cpu
+    received = count[0]
+    sent = sum(device.sent for device in devices) - sent_before
+    if managed:
+        manager.stop()
+        manager.join()
+    else:
+        for wm in wiimotes:
+            wm.disconnect()
+    emulation.stop()
+    return 100.0 * received / max(sent, 1), 100.0 * cpu / duration
+
+
+def best_of(runs, bench, *args):
+    return max(bench(*args) for i in range(runs))
+
+
+if __name__ == '__main__':
+    num_reports = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    print("receiving %d reports of type 0x%02x (best of 3)" %
+          (num_reports, SAMPLE_REPORT[1]))
+    print("legacy:  %8.0f reports/s" %
+          best_of(3, bench_throughput, LegacyLoopbackWiiMote, num_reports))
+    print("current: %8.0f reports/s" %
+          best_of(3, bench_throughput, LoopbackWiiMote, num_reports))
+    print("recv():  %8.0f reports/s (fallback without recv_into)" %
+          best_of(3, bench_throughput, FallbackLoopbackWiiMote, num_reports))
+    print("stats:   %8.0f reports/s" %
+          best_of(3, bench_throughput, InstrumentedLoopbackWiiMote, num_reports))
+    print("peak bytes allocated per report (legacy, recv(), current):")
+    for decode, label in [(False, "receiving"), (True, "incl. decoding")]:
+        allocations = bench_allocations(num_reports, decode)
+        if allocations is None:
+            print("  n/a (needs tracemalloc.reset_peak)")
+            break
+        print("  %-15s %6.0f %6.0f %6.0f" % ((label,) + tuple(allocations)))
+    print("CPU per controller at 100 reports/s each (incl. feeding):")
+    print("  N  thread each  manager")
+    for num_controllers in (1, 2, 4, 8, 16):
+        print("%3d %10.2f%% %7.2f%%" % (
+            num_controllers,
+            bench_cpu_per_controller(num_controllers, False),
+            bench_cpu_per_controller(num_controllers, True)))
+    print("emulated Wiimotes at 1000 reports/s each (delivered, CPU):")
+    print("  N  thread each        manager")
+    for num_devices in (1, 4, 16):
+        print("%3d %5.1f%% %6.1f%%  %5.1f%% %6.1f%%" % (
+            (num_devices,) + bench_emulated(num_devices) +
+            bench_emulated(num_devices, managed=True)))
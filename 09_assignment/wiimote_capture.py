@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Binary capture files of raw Wiimote reports.
+#
+#   wm.start_capture("session.wcap")  # appends every received report
+#   ...
+#   wm.stop_capture()
+#
+#   capture = wiimote_capture.open_capture("session.wcap")
+#   capture.records['time'], capture.records['id'] # numpy views, no parsing
+#   first_minute = capture.between(capture.start, capture.start + 60)
+#
+# A capture file is a 64 byte header (HEADER_DTYPE) followed by 32 byte
+# records (RECORD_DTYPE): the monotonic receive time, the report id, the
+# number of payload bytes and the payload (the report without its id).
+# Records are written as they arrive, so a file can be read while it is
+# still being written and a crash loses at most the buffered records.
+
+import numpy as np
+import struct
+import threading
+import time
+
+MAGIC = b'WIICAP\r\n'
+VERSION = 1
+
+HEADER_DTYPE = np.dtype([('magic', 'S8'), ('version', '<u2'),
+                         ('record_size', '<u2'),
+                         ('created', '<f8'), # wall clock time, time.time()
+                         ('address', 'S20'), ('model', 'S24')])
+RECORD_DTYPE = np.dtype([('time', '<f8'), ('id', 'u1'), ('length', 'u1'),
+                         ('data', 'u1', (22,))])
+
+_RECORD_HEAD = struct.Struct('<dBB')
+
+
+class CaptureWriter(object):
+    """
+    Appends reports to a capture file. Used by WiiMote.start_capture().
+    """
+
+    def __init__(self, path, address, model):
+        self._lock = threading.Lock()
+        self._file = open(path, 'ab')
+        self._record = bytearray(RECORD_DTYPE.itemsize)
+        self._length = 0
+        if self._file.tell() == 0:
+            header = np.zeros(1, HEADER_DTYPE)
+            header[0] = (MAGIC, VERSION, RECORD_DTYPE.itemsize, time.time(),
+                         address.encode(), model.encode())
+            self._file.write(header.tobytes())
+
+    def write(self, timestamp, buf, num_bytes):
+        """
+        Appends the report received into *buf* (starting with the 0xa1
+        header, *num_bytes* long).
+        """
+        record = self._record
+        length = num_bytes - 2
+        _RECORD_HEAD.pack_into(record, 0, timestamp, buf[1], length)
+        record[10:10 + length] = buf[2:num_bytes]
+        if length < self._length: # clear the end of a longer report
+            record[10 + length:] = bytearray(22 - length)
+        self._length = length
+        with self._lock:
+            if self._file is not None:
+                self._file.write(record)
+
+    def flush(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class Capture(object):
+    """
+    A memory-mapped capture file. *records* is a read-only structured
+    array of all complete records (see RECORD_DTYPE); *header* holds the
+    fields of HEADER_DTYPE.
+    """
+
+    def __init__(self, path):
+        header = np.fromfile(path, HEADER_DTYPE, count=1)
+        if len(header) == 0 or header[0]['magic'] != MAGIC:
+            raise IOError("%s is not a Wiimote capture file" % path)
+        self.header = header[0]
+        if self.header['version'] != VERSION or \
+           self.header['record_size'] != RECORD_DTYPE.itemsize:
+            raise IOError("unsupported capture file version %d" %
+                          self.header['version'])
+        with open(path, 'rb') as f:
+            f.seek(0, 2)
+            size = f.tell()
+        # ignore a partially written last record
+        count = (size - HEADER_DTYPE.itemsize) // RECORD_DTYPE.itemsize
+        if count > 0:
+            self.records = np.memmap(path, RECORD_DTYPE, 'r',
+                                     HEADER_DTYPE.itemsize, (count,))
+        else:
+            self.records = np.zeros(0, RECORD_DTYPE)
+        self.address = self.header['address'].decode()
+        self.model = self.header['model'].decode()
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def start(self):
+        return self.records['time'][0] if len(self.records) else 0.0
+
+    @property
+    def end(self):
+        return self.records['time'][-1] if len(self.records) else 0.0
+
+    def between(self, start, end):
+        """
+        Returns a view of the records received in [*start*, *end*).
+        Times are monotonic, so this is a binary search.
+        """
+        times = self.records['time']
+        first, last = np.searchsorted(times, [start, end])
+        return self.records[first:last]
+
+    def of_type(self, report_ids, records=None):
+        """ Returns a copy of the records (default: all) of the given ids. """
+        records = self.records if records is None else records
+        return records[np.isin(records['id'], report_ids)]
+
+    def reports(self, records=None):
+        """
+        Yields (time, report) tuples of the records (default: all), with
+        each report as a bytearray starting with the report id.
+        """
+        records = self.records if records is None else records
+        for timestamp, rpt_id, length, data in records.tolist():
+            report = bytearray([rpt_id])
+            report.extend(data[:length])
+            yield timestamp, report
+
+
+def open_capture(path):
+    return Capture(path)
+
+
+def is_capture(path):
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
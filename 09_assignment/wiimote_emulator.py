@@ -0,0 +1,474 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Emulates Wiimotes in-process, for testing the driver without Bluetooth.
+#
+#   wm = wiimote_emulator.connect(rate=1000)    # a WiiMote like any other
+#   wm = wiimote.connect("emulator:", rate=1000) # the same
+#   wm.device.buttons = 0x0008                  # press A
+#   wm.device.drop()                            # lose the connection
+#
+#   emulation = wiimote_emulator.Emulation()
+#   wiimotes = [emulation.connect(rate=500) for i in range(16)]
+#   manager = emulation.manager()               # or all on one WiimoteManager
+#   wm = manager.connect(emulation.add_device().btaddr)
+#
+# Each emulated Device sits behind one end of a socketpair and speaks the
+# part of the WiiBrew protocol the driver uses: LEDs, rumble, reporting
+# modes (all but the interleaved 0x3e/0x3f), IR camera enable, status
+# requests, and memory reads and writes of the EEPROM and the control
+# registers. Data reports are generated at a fixed *rate* from a motion
+# function; reports the driver can not take in time are dropped, as they
+# would be over the air. Like a real Wiimote, a device only sends a report
+# if its data has changed, unless the driver asked for continuous
+# reporting (see still_motion()). All devices of an Emulation are served
+# by one thread.
+
+import collections
+import errno
+import math
+import select
+import socket
+import threading
+
+import wiimote
+
+# accelerometer calibration as stored in the EEPROM: 0 g at 512, 1 g at 616
+CALIBRATION = [0x80, 0x80, 0x80, 0x00, 0x9a, 0x9a, 0x9a, 0x00, 0x00]
+CALIBRATION.append((sum(CALIBRATION) + 0x55) & 0xff)
+
+EEPROM_SIZE = 0x1700
+
+# number of extension bytes in each data report
+EXTENSION_BYTES = {0x32: 8, 0x34: 19, 0x35: 16, 0x36: 9, 0x37: 6, 0x3d: 21}
+DATA_REPORTS = [0x30, 0x31, 0x32, 0x33, 0x34, 0x35, 0x36, 0x37, 0x3d]
+
+_DROPPED_ERRORS = (errno.EAGAIN, errno.EWOULDBLOCK, errno.ENOBUFS)
+
+
+def circle_motion(t):
+    """
+    Default motion: the Wiimote tilts from side to side once per second
+    while two IR objects circle around the center of the camera image.
+    Returns raw (x, y, z) accelerometer values and a list of (x, y, size)
+    IR objects.
+    """
+    angle = 2 * math.pi * t
+    acc = (512 + int(104 * math.sin(angle)), 512, 616 + int(20 * math.cos(angle)))
+    objects = [(int(512 + 300 * math.cos(angle + offset)),
+                int(384 + 200 * math.sin(angle + offset)), 3)
+               for offset in (0, math.pi)]
+    return acc, objects
+
+
+def still_motion(t):
+    """
+    The Wiimote lies still, face up, with nothing in view of the camera.
+    Without continuous reporting, it sends no data reports at all.
+    """
+    return (512, 512, 616), []
+
+
+class Device(object):
+    """
+    State and protocol of one emulated Wiimote. *motion* is a function of
+    the time since the device was created, see circle_motion(). *extension*
+    is None or 'nunchuk'. The driver's commands are counted by report id
+    in *commands*; *sent* and *dropped* count data reports.
+    """
+
+    def __init__(self, emulation, btaddr, model, rate=100, motion=None,
+                 extension=None):
+        self.btaddr = btaddr
+        self.model = model
+        self.rate = rate
+        self.motion = motion or circle_motion
+        self.buttons = 0 # button bits as in wiimote.Buttons.BUTTONS
+        self.leds = [False] * 4
+        self.rumble = False
+        self.mode = 0x30
+        self.continuous = False
+        self.ir_enabled = False
+        self.eeprom = bytearray(EEPROM_SIZE)
+        self.eeprom[0x16:0x20] = bytearray(CALIBRATION)
+        self.eeprom[0x20:0x2a] = bytearray(CALIBRATION)
+        self.registers = {} # address -> byte
+        self.extension = None
+        self.commands = collections.Counter()
+        self.sent = 0
+        self.dropped = 0
+        self._last_report = None # the data report sent last
+        self._emulation = emulation
+        self._sock = None
+        self._ir_enables = [False, False] # reports 0x13 and 0x1a
+        self._start = wiimote._monotonic()
+        self._due = self._start
+        if extension is not None:
+            self._set_extension(extension)
+
+    def __repr__(self):
+        return "<emulated Wiimote %s, mode 0x%02x>" % (self.btaddr, self.mode)
+
+    def plug(self, extension='nunchuk'):
+        """ Plugs in an extension, which the driver learns from a status report. """
+        self._emulation._call_soon(lambda: self._plug(extension))
+
+    def unplug(self):
+        self._emulation._call_soon(lambda: self._plug(None))
+
+    def drop(self):
+        """ Loses the connection, as if the Wiimote went out of range. """
+        self._emulation._call_soon(self._detach)
+
+    def _plug(self, extension):
+        self._set_extension(extension)
+        self._send_status()
+
+    def _set_extension(self, extension):
+        if extension not in [None, 'nunchuk']:
+            raise TypeError("unsupported extension '%s'" % extension)
+        self.extension = extension
+        identifier = [0x00, 0x00, 0xa4, 0x20, 0x00, 0x00] if extension else [0x00] * 6
+        for offset, value in enumerate(identifier):
+            self.registers[0xa400fa + offset] = value
+
+    def _attach(self, sock):
+        self._detach()
+        sock.setblocking(False)
+        self._sock = sock
+        self._last_report = None
+        self._due = wiimote._monotonic()
+
+    def _detach(self):
+        if self._sock is not None:
+            self._emulation._forget(self._sock)
+            self._sock.close()
+            self._sock = None
+
+    def _receive(self):
+        try:
+            command = bytearray(self._sock.recv(32))
+        except socket.error as e:
+            if e.errno in _DROPPED_ERRORS:
+                return
+            command = bytearray()
+        if len(command) < 3: # the driver hung up
+            self._detach()
+            return
+        self._handle_command(command[1], command[2:])
+
+    def _handle_command(self, rpt, payload):
+        self.commands[rpt] += 1
+        self.rumble = bool(payload[0] & 0x01)
+        if rpt == 0x11:
+            self.leds = [bool(payload[0] & bit) for bit in (0x10, 0x20, 0x40, 0x80)]
+        elif rpt == 0x12:
+            self.continuous = bool(payload[0] & 0x04)
+            self.mode = payload[1]
+            self._last_report = None # the new mode is reported in any case
+        elif rpt in (0x13, 0x1a):
+            self._ir_enables[rpt == 0x1a] = bool(payload[0] & 0x04)
+            self.ir_enabled = all(self._ir_enables)
+        elif rpt == 0x15:
+            self._send_status()
+        elif rpt == 0x16:
+            self._write(payload)
+        elif rpt == 0x17:
+            self._read(payload)
+        if payload[0] & 0x02 and rpt not in (0x15, 0x16, 0x17):
+            # acknowledgement requested
+            self._send([0x22] + self._button_bytes() + [rpt, 0x00])
+
+    def _button_bytes(self):
+        return [(self.buttons >> 8) & 0x1f, self.buttons & 0x9f]
+
+    def _send_status(self):
+        flags = sum(bit for bit, on in zip((0x10, 0x20, 0x40, 0x80), self.leds) if on)
+        if self.ir_enabled:
+            flags |= 0x08
+        if self.extension:
+            flags |= 0x02
+        self._send([0x20] + self._button_bytes() + [flags, 0x00, 0x00, 0xc0])
+
+    def _write(self, payload):
+        address = (payload[1] << 16) | (payload[2] << 8) | payload[3]
+        data = payload[5:5 + payload[4]]
+        error = 0x00
+        if payload[0] & 0x04:
+            for offset, value in enumerate(data):
+                self.registers[address + offset] = value
+        elif address + len(data) <= EEPROM_SIZE:
+            self.eeprom[address:address + len(data)] = data
+        else:
+            error = 0x08
+        self._send([0x22] + self._button_bytes() + [0x16, error])
+
+    def _read(self, payload):
+        address = (payload[1] << 16) | (payload[2] << 8) | payload[3]
+        remaining = (payload[4] << 8) | payload[5]
+        registers = bool(payload[0] & 0x04)
+        if not registers and address + remaining > EEPROM_SIZE:
+            self._send([0x21] + self._button_bytes() +
+                       [0x08, (address >> 8) & 0xff, address & 0xff] + [0x00] * 16)
+            return
+        while remaining > 0:
+            size = min(remaining, 16)
+            if registers:
+                data = [self.registers.get(address + i, 0x00) for i in range(size)]
+            else:
+                data = list(self.eeprom[address:address + size])
+            self._send([0x21] + self._button_bytes() +
+                       [(size - 1) << 4, (address >> 8) & 0xff, address & 0xff] +
+                       data + [0x00] * (16 - size))
+            address += size
+            remaining -= size
+
+    def _data_report(self, now):
+        acc, objects = self.motion(now - self._start)
+        mode = self.mode
+        if mode not in DATA_REPORTS:
+            return None
+        if mode == 0x3d:
+            return [mode] + self._extension_bytes(acc, 21)
+        buttons = self._button_bytes()
+        report = [mode] + buttons
+        if mode in (0x31, 0x33, 0x35, 0x37):
+            x, y, z = acc
+            # the least significant bits are spread over the button bytes
+            report[1] |= (x & 0x03) << 5
+            report[2] |= ((y & 0x02) << 4) | ((z & 0x02) << 5)
+            report += [x >> 2, y >> 2, z >> 2]
+        if mode == 0x33:
+            report += self._ir_extended(objects)
+        elif mode in (0x36, 0x37):
+            report += self._ir_basic(objects)
+        if mode in EXTENSION_BYTES:
+            report += self._extension_bytes(acc, EXTENSION_BYTES[mode])
+        return report
+
+    def _ir_objects(self, objects):
+        # up to four (x, y, size) objects, empty slots are 1023
+        if not self.ir_enabled:
+            objects = []
+        objects = list(objects[:4])
+        return objects + [(1023, 1023, 15)] * (4 - len(objects))
+
+    def _ir_extended(self, objects):
+        data = []
+        for x, y, size in self._ir_objects(objects):
+            data += [x & 0xff, y & 0xff,
+                     ((y >> 8) << 6) | ((x >> 8) << 4) | (size & 0x0f)]
+        return data
+
+    def _ir_basic(self, objects):
+        objects = self._ir_objects(objects)
+        data = []
+        for (x1, y1, size1), (x2, y2, size2) in (objects[0:2], objects[2:4]):
+            data += [x1 & 0xff, y1 & 0xff,
+                     ((y1 >> 8) << 6) | ((x1 >> 8) << 4) |
+                     ((y2 >> 8) << 2) | (x2 >> 8),
+                     x2 & 0xff, y2 & 0xff]
+        return data
+
+    def _extension_bytes(self, acc, length):
+        if self.extension != 'nunchuk' or self.registers.get(0xa400f0) != 0x55:
+            return [0x00] * length
+        x, y, z = acc
+        # stick centered, C and Z released (active low)
+        low = ((z & 0x03) << 6) | ((y & 0x03) << 4) | ((x & 0x03) << 2) | 0x03
+        data = [0x80, 0x80, x >> 2, y >> 2, z >> 2, low]
+        return data + [0x00] * (length - len(data))
+
+    def _tick(self, now):
+        # sends the data report due at *now*, if any
+        interval = 1.0 / self.rate
+        if now - self._due > 0.1: # far behind, skip instead of bursting
+            self._due = now
+        self._due += interval
+        report = self._data_report(now)
+        if report is None or (report == self._last_report and
+                              not self.continuous):
+            return
+        if self._send(report):
+            self._last_report = report
+            self.sent += 1
+
+    def _send(self, report):
+        if self._sock is None:
+            return False
+        try:
+            self._sock.send(bytes(bytearray([0xa1] + report)))
+        except socket.error as e:
+            if e.errno in _DROPPED_ERRORS:
+                self.dropped += 1
+            else:
+                self._detach()
+            return False
+        return True
+
+
+class _EmulatedConnection(object):
+    # connects a CommunicationHandler to wiimote.device instead of Bluetooth
+
+    def _connect(self):
+        self._datasocket, device_socket = socket.socketpair(
+            socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        self._controlsocket = self._datasocket
+        self.wiimote.device._emulation._attach(self.wiimote.device, device_socket)
+
+
+class EmulatedCommunicationHandler(_EmulatedConnection,
+                                   wiimote.CommunicationHandler):
+    pass
+
+
+class ManagedEmulatedCommunicationHandler(_EmulatedConnection,
+                                          wiimote.ManagedCommunicationHandler):
+    pass
+
+
+class EmulatedWiiMote(wiimote.WiiMote):
+    """ WiiMote connected to an emulated *device*. """
+
+    _com_class = EmulatedCommunicationHandler
+    _persistent = False
+
+    def __init__(self, device):
+        self.device = device
+        wiimote.WiiMote.__init__(self, device.btaddr, device.model)
+
+
+class ManagedEmulatedWiiMote(wiimote.ManagedWiiMote):
+
+    _com_class = ManagedEmulatedCommunicationHandler
+    _persistent = False
+
+    def __init__(self, btaddr, model, manager):
+        self.device = manager.emulation.devices[btaddr]
+        wiimote.ManagedWiiMote.__init__(self, btaddr, model, manager)
+
+
+class EmulatedManager(wiimote.WiimoteManager):
+    """ WiimoteManager for the devices of *emulation*. """
+
+    _wiimote_class = ManagedEmulatedWiiMote
+
+    def __init__(self, emulation):
+        self.emulation = emulation
+        wiimote.WiimoteManager.__init__(self)
+
+    def connect(self, btaddr, model=None):
+        if model is None:
+            model = self.emulation.devices[btaddr].model
+        return wiimote.WiimoteManager.connect(self, btaddr, model)
+
+
+class Emulation(threading.Thread):
+    """
+    Serves any number of emulated Devices from one thread: answers their
+    drivers' commands and sends each device's data reports on time.
+    """
+
+    def __init__(self):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.devices = collections.OrderedDict() # by btaddr
+        self.running = True
+        self._sockets = {} # device socket -> Device
+        self._calls = collections.deque()
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+        self._wakeup_r.setblocking(False)
+        self.start()
+
+    def add_device(self, btaddr=None, model=None, **options):
+        """
+        Creates a Device, see there for the *options* (rate, motion,
+        extension). Addresses are numbered from 00:00:00:00:00:00 if none
+        is given.
+        """
+        if btaddr is None:
+            number = len(self.devices)
+            btaddr = ':'.join("%02x" % ((number >> shift) & 0xff)
+                              for shift in (40, 32, 24, 16, 8, 0))
+        if model is None:
+            model = wiimote.KNOWN_DEVICES[1]
+        device = Device(self, btaddr, model, **options)
+        self.devices[btaddr] = device
+        return device
+
+    def connect(self, btaddr=None, model=None, **options):
+        """
+        Returns an EmulatedWiiMote connected to the device at *btaddr*,
+        which is added with the *options* if it does not exist yet.
+        """
+        device = self.devices.get(btaddr)
+        if device is None:
+            device = self.add_device(btaddr, model, **options)
+        return EmulatedWiiMote(device)
+
+    def manager(self):
+        """ Returns a WiimoteManager that connects to this emulation's devices. """
+        return EmulatedManager(self)
+
+    def stop(self):
+        self.running = False
+        self._call_soon(lambda: None)
+
+    def _attach(self, device, sock):
+        # called by the driver, the socket is used from the next loop on
+        self._call_soon(lambda: self._add_socket(device, sock))
+
+    def _add_socket(self, device, sock):
+        device._attach(sock)
+        self._sockets[sock] = device
+
+    def _forget(self, sock):
+        self._sockets.pop(sock, None)
+
+    def _call_soon(self, func):
+        self._calls.append(func)
+        try:
+            self._wakeup_w.send(b'x')
+        except socket.error:
+            pass # already woken up
+
+    def run(self):
+        while self.running:
+            devices = list(self._sockets.values())
+            if devices:
+                timeout = max(min(device._due for device in devices) -
+                              wiimote._monotonic(), 0)
+            else:
+                timeout = None
+            readable = select.select([self._wakeup_r] + list(self._sockets),
+                                     [], [], timeout)[0]
+            for sock in readable:
+                if sock is self._wakeup_r:
+                    try:
+                        self._wakeup_r.recv(512)
+                    except socket.error:
+                        pass
+                    while self._calls:
+                        self._calls.popleft()()
+                elif sock in self._sockets:
+                    self._sockets[sock]._receive()
+            now = wiimote._monotonic()
+            for device in list(self._sockets.values()):
+                if device._due <= now:
+                    device._tick(now)
+        for device in list(self.devices.values()):
+            device._detach()
+
+
+_emulation = None
+
+
+def connect(btaddr=None, model=None, **options):
+    """
+    Connects to an emulated Wiimote of a shared Emulation, see
+    Emulation.connect(). Also used by wiimote.connect("emulator:[btaddr]").
+    """
+    global _emulation
+    if _emulation is None:
+        _emulation = Emulation()
+    return _emulation.connect(btaddr or None, model, **options)
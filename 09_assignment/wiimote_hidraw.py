@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Linux hidraw transport: talks to a Wiimote that has been paired and
+# connected by the operating system (e.g. with bluetoothctl) through its
+# /dev/hidrawN device node, so PyBluez is not needed.
+#
+#   wm = wiimote.connect("hidraw:")                # the first Wiimote found
+#   wm = wiimote.connect("hidraw:/dev/hidraw3")
+#   wiimote_hidraw.find()  # [('/dev/hidraw3', '00:1f:32:...', model), ...]
+#
+# The device node needs read and write permission. The kernel's hid-wiimote
+# driver keeps running next to this one and may switch the reporting mode
+# on its own, so unload it (rmmod hid_wiimote) for undisturbed data.
+#
+# hidraw passes reports without the 0xa1/0xa2 transaction header of the
+# L2CAP channels; HidrawSocket adds and removes it, so the driver's
+# CommunicationHandler works unchanged.
+
+import errno
+import glob
+import os
+import select
+import socket
+
+import wiimote
+
+SYSFS_PATTERN = '/sys/class/hidraw/hidraw*/device/uevent'
+
+
+def find():
+    """
+    Returns a list of (device_path, bt_addr, device_name) tuples of the
+    Wiimotes the kernel knows.
+    """
+    wiimotes = []
+    for uevent in sorted(glob.glob(SYSFS_PATTERN)):
+        info = _read_uevent(uevent)
+        if info.get('HID_NAME') in wiimote.KNOWN_DEVICES:
+            node = uevent.split(os.sep)[-3]
+            wiimotes.append((os.path.join('/dev', node),
+                             info.get('HID_UNIQ', node), info['HID_NAME']))
+    return wiimotes
+
+
+def connect(path, model=None):
+    """
+    Returns a HidrawWiiMote for the device node at *path*, or for the first
+    Wiimote found if *path* is empty.
+    """
+    devices = find()
+    if not path:
+        if not devices:
+            raise IOError("No Wiimote found in %s" % SYSFS_PATTERN)
+        path = devices[0][0]
+    btaddr = path
+    for device_path, device_btaddr, device_model in devices:
+        if device_path == path:
+            btaddr = device_btaddr
+            model = model or device_model
+    if model not in wiimote.KNOWN_DEVICES:
+        raise Exception("Wiimote model '%s' unknown!" % (model))
+    return HidrawWiiMote(path, btaddr, model)
+
+
+def _read_uevent(path):
+    info = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                key, _, value = line.strip().partition('=')
+                info[key] = value
+    except (IOError, OSError):
+        pass
+    return info
+
+
+class HidrawSocket(object):
+    """
+    The subset of the socket interface the driver uses, on a hidraw node.
+    Received reports get the 0xa1 header, sent ones lose their 0xa2/0x52
+    header.
+    """
+
+    def __init__(self, path):
+        self._fd = os.open(path, os.O_RDWR)
+        self._timeout = None
+
+    def fileno(self):
+        return self._fd
+
+    def settimeout(self, timeout):
+        self._timeout = timeout
+
+    def recv(self, size):
+        if self._timeout is not None and \
+           not select.select([self._fd], [], [], self._timeout)[0]:
+            raise socket.timeout("timed out")
+        try:
+            data = os.read(self._fd, size - 1)
+        except OSError as e:
+            if e.errno in (errno.ENODEV, errno.EIO):
+                return b'' # disconnected, like a closed socket
+            raise IOError(e.errno, e.strerror)
+        return b'\xa1' + data if data else b''
+
+    def send(self, data):
+        os.write(self._fd, data[1:])
+        return len(data)
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+class HidrawCommunicationHandler(wiimote.CommunicationHandler):
+
+    def _connect(self):
+        self._datasocket = HidrawSocket(self.wiimote.path)
+        self._controlsocket = self._datasocket
+
+
+class HidrawWiiMote(wiimote.WiiMote):
+    """
+    WiiMote connected through a hidraw device node at *path*. Use
+    connect() to create one.
+    """
+
+    _com_class = HidrawCommunicationHandler
+    _persistent = False
+
+    def __init__(self, path, btaddr, model):
+        self.path = path
+        wiimote.WiiMote.__init__(self, btaddr, model)
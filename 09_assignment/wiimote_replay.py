@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Replays recorded reports through the wiimote driver instead of a Bluetooth
+# connection, so applications can run headless against captured data.
+#
+#   wm = wiimote.connect("replay:session.txt")            # real time
+#   wm = wiimote.connect("replay:session.txt", speed=10)  # ten times faster
+#   wm = wiimote.connect("replay:session.txt", speed=None) # as fast as possible
+#   wm.accelerometer.register_callback(...)
+#   wm.wait() # until the recording has been replayed completely
+#
+# A recording is either a capture file written by WiiMote.start_capture()
+# (see wiimote_capture) or a text file with one report per line: the receive
+# time in seconds followed by the report bytes in hex, starting with the
+# report id. Lines starting with '#' are ignored.
+#
+#   12.504310 33600880819a405013405013ffffffffffff
+
+import binascii
+import collections
+import select
+import socket
+import threading
+
+import wiimote
+import wiimote_capture
+
+REPLAY_PREFIX = "replay:"
+
+# reports the driver has to answer itself; recorded ones belong to requests
+# that were made during the recording, not to the replaying driver's
+IGNORED_REPORTS = [wiimote.Memory.RPT_READ_DATA, wiimote.Memory.RPT_ACK]
+
+# IR camera mode that produces a report mode
+IR_MODES = {0x33: wiimote.IRCam.MODE_EXTENDED,
+            0x36: wiimote.IRCam.MODE_BASIC,
+            0x37: wiimote.IRCam.MODE_BASIC,
+            0x3e: wiimote.IRCam.MODE_FULL,
+            0x3f: wiimote.IRCam.MODE_FULL}
+
+
+def connect(path, model=None, speed=1.0):
+    """
+    Returns a ReplayWiiMote that replays the recording at *path*.
+    *speed* scales the replay rate; None replays as fast as the driver
+    can handle the reports.
+    """
+    if model is None:
+        model = wiimote.KNOWN_DEVICES[0]
+    return ReplayWiiMote(path, model, load(path), speed)
+
+
+def load(path):
+    """
+    Reads a recording and returns a list of (time, report) tuples, with
+    each report as a bytearray starting with the report id.
+    """
+    if wiimote_capture.is_capture(path):
+        capture = wiimote_capture.open_capture(path)
+        return [(timestamp, report) for timestamp, report in capture.reports()
+                if report[0] not in IGNORED_REPORTS]
+    recording = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            timestamp, data = line.split()
+            report = bytearray(binascii.unhexlify(data))
+            if report[0] not in IGNORED_REPORTS:
+                recording.append((float(timestamp), report))
+    return recording
+
+
+def save(path, recording):
+    """ Writes (time, report) tuples in the format read by load(). """
+    with open(path, 'w') as f:
+        for timestamp, report in recording:
+            f.write("%.6f %s\n" % (timestamp,
+                                   binascii.hexlify(bytes(report)).decode()))
+
+
+class Player(threading.Thread):
+    """
+    Plays a recording into one end of a socketpair, spaced out as recorded
+    and divided by *speed*. Also answers the driver's memory accesses like
+    a Wiimote with empty memory would.
+    """
+
+    def __init__(self, sock, recording, speed):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self._sock = sock
+        self._recording = recording
+        self._speed = speed
+        self._playing = threading.Event()
+        # recorded times of the reports sent so far, for the receiving side
+        self.times = collections.deque()
+
+    def play(self):
+        """ Starts sending the recorded reports. """
+        self._playing.set()
+
+    def run(self):
+        try:
+            # only commands until the driver is set up
+            while not self._playing.is_set():
+                if select.select([self._sock], [], [], 0.05)[0]:
+                    self._answer()
+            self._play()
+        except socket.error:
+            pass # the driver hung up
+        finally:
+            self._sock.close()
+
+    def _play(self):
+        if not self._recording:
+            return
+        start = wiimote._monotonic()
+        first_time = self._recording[0][0]
+        for timestamp, report in self._recording:
+            if self._speed:
+                due = start + (timestamp - first_time) / self._speed
+            else:
+                due = start
+            while True:
+                delay = due - wiimote._monotonic()
+                if delay > 0:
+                    if select.select([self._sock], [], [], delay)[0]:
+                        self._answer()
+                    continue
+                readable, writable = select.select([self._sock], [self._sock],
+                                                   [], None)[:2]
+                if readable:
+                    self._answer()
+                if writable:
+                    break
+            self.times.append(timestamp)
+            self._sock.send(b'\xa1' + bytes(report))
+
+    def _answer(self):
+        command = bytearray(self._sock.recv(32))
+        if len(command) < 2:
+            raise socket.error("driver disconnected")
+        rpt = command[1]
+        if rpt == wiimote.Memory.RPT_WRITE or \
+           command[2] & wiimote.Memory.ACK_REQUEST:
+            self._send_reply([0x22, 0x00, 0x00, rpt, 0x00])
+        elif rpt == wiimote.Memory.RPT_READ:
+            address = (command[4] << 8) | command[5]
+            remaining = (command[6] << 8) | command[7]
+            while remaining > 0:
+                size = min(remaining, 16)
+                self._send_reply([0x21, 0x00, 0x00, (size - 1) << 4,
+                                  (address >> 8) & 0xff, address & 0xff] +
+                                 [0x00] * 16)
+                address += size
+                remaining -= size
+
+    def _send_reply(self, report):
+        self._sock.send(bytes(bytearray([0xa1] + report)))
+
+
+class ReplayCommunicationHandler(wiimote.CommunicationHandler):
+    """
+    Receives the reports of a Player through a socketpair. Reports are
+    timestamped with their recorded time instead of the time of arrival.
+    All recorded report ids are handled, whatever the current reporting
+    mode, as the recording may switch modes.
+    """
+
+    _recorded_reports = None
+
+    def _expected_reports(self):
+        if self._recorded_reports is None:
+            self._recorded_reports = sorted(set(
+                report[0] for timestamp, report in self.wiimote._recording))
+        return (wiimote.CommunicationHandler._expected_reports(self) +
+                self._recorded_reports)
+
+    def _connect(self):
+        self._datasocket, player_socket = socket.socketpair(
+            socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        self._controlsocket = self._datasocket
+        self._player = Player(player_socket, self.wiimote._recording,
+                              self.wiimote._speed)
+        self._player.start()
+
+    def _timestamp(self):
+        if self._buffer[1] in IGNORED_REPORTS:
+            return wiimote._monotonic()
+        return self._player.times.popleft()
+
+
+class ReplayWiiMote(wiimote.WiiMote):
+    """
+    WiiMote that receives a recording instead of a Bluetooth device.
+    Use connect() to create one.
+    """
+
+    _com_class = ReplayCommunicationHandler
+    _persistent = False
+
+    def __init__(self, path, model, recording, speed):
+        self._recording = recording
+        self._speed = speed
+        wiimote.WiiMote.__init__(self, REPLAY_PREFIX + path, model)
+
+    def _start(self):
+        self._com.start()
+        # switch to the recorded mode, so that no report gets dropped
+        modes = [report[0] for timestamp, report in self._recording
+                 if report[0] >= wiimote.CommunicationHandler.MODE_DEFAULT]
+        if modes:
+            if modes[0] in IR_MODES:
+                self.ir.set_mode_sensitivity(IR_MODES[modes[0]],
+                                             self.ir._sensitivity)
+            self._com.set_report_mode(modes[0])
+        # the player's memory is empty, so this keeps the default calibration
+        self.accelerometer.load_calibration()
+        self.leds[0] = True
+        self._com._player.play()
+
+    def _update_report_mode(self, force=False):
+        return None # the recording decides what is reported
+
+    def wait(self, timeout=None):
+        """
+        Blocks until all reports have been handled or *timeout* seconds
+        have passed. Returns True if the replay has finished.
+        """
+        self._com.join(timeout)
+        return not self._com.is_alive()